@@ -1,18 +1,34 @@
 import os
 import io
+import csv
+import json
+import tempfile
+import time
+import shutil
+import gzip
+import sqlite3
+import click
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory
+import subprocess
+import sys
+import threading
+from collections import OrderedDict
+from flask import Flask, Blueprint, current_app, has_request_context, jsonify, render_template, request, redirect, url_for, flash, session, send_from_directory, send_file, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate, upgrade
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from sqlalchemy import case, func, desc, and_, MetaData, Enum
+from sqlalchemy import case, func, desc, and_, select, insert, update, delete, event, inspect, MetaData, Enum
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+from jinja2 import nodes, FileSystemBytecodeCache
+from jinja2.ext import Extension
 from collections import defaultdict
 from functools import wraps
 import enum
-import qrcode
-import base64
-from io import BytesIO
 
 # --- 1. Configuración de la Aplicación y la Base de Datos ---
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -23,14 +39,34 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'una_clave_muy_secreta_y_aleatoria'
     UPLOAD_FOLDER = os.path.join(basedir, 'static', 'uploads')
+    # Las subidas se reciben aquí y un trabajo en segundo plano las optimiza y mueve a UPLOAD_FOLDER
+    UPLOAD_INCOMING_FOLDER = os.path.join(basedir, 'instance', 'incoming')
+    # Las fotos se reducen a este lado máximo (en píxeles) al pasar a UPLOAD_FOLDER
+    UPLOAD_MAX_IMAGE_SIDE = int(os.environ.get('UPLOAD_MAX_IMAGE_SIDE', 1600))
+    UPLOAD_JPEG_QUALITY = int(os.environ.get('UPLOAD_JPEG_QUALITY', 85))
+    QR_CACHE_FOLDER = os.path.join(basedir, 'instance', 'qr')
+    ARCHIVE_FOLDER = os.path.join(basedir, 'instance', 'archive')
+    # Cola de trabajos en segundo plano
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+    JOB_RETRY_BASE_SECONDS = int(os.environ.get('JOB_RETRY_BASE_SECONDS', 10))
+    JOB_LOCK_TIMEOUT_SECONDS = int(os.environ.get('JOB_LOCK_TIMEOUT_SECONDS', 600))
+    # Canal SSE de estados: cada cuánto se consulta la tabla de eventos y cuánto vive una conexión
+    STATUS_STREAM_POLL_SECONDS = float(os.environ.get('STATUS_STREAM_POLL_SECONDS', 2))
+    STATUS_STREAM_MAX_SECONDS = float(os.environ.get('STATUS_STREAM_MAX_SECONDS', 300))
+    # La página pública de seguimiento no requiere sesión: conexiones más cortas
+    PUBLIC_STREAM_MAX_SECONDS = float(os.environ.get('PUBLIC_STREAM_MAX_SECONDS', 60))
+    # Tope de conexiones SSE abiertas por proceso; con workers gthread la suma debe quedar por
+    # debajo de GUNICORN_THREADS para que siempre haya hilos libres para el resto de las páginas
+    PUBLIC_STREAM_MAX_CONNECTIONS = int(os.environ.get('PUBLIC_STREAM_MAX_CONNECTIONS', 8))
+    STAFF_STREAM_MAX_CONNECTIONS = int(os.environ.get('STAFF_STREAM_MAX_CONNECTIONS', 16))
+    # Los eventos solo sirven para reconectar el canal SSE; `flask archive-devices` borra los más viejos
+    STATUS_EVENT_RETENTION_DAYS = int(os.environ.get('STATUS_EVENT_RETENTION_DAYS', 7))
+    # Plantillas: bytecode compilado compartido entre workers y caché de fragmentos (0 la desactiva)
+    TEMPLATE_BYTECODE_CACHE_DIR = os.path.join(basedir, 'instance', 'jinja_cache')
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 5000))
+    # Un componente con stock igual o menor a este valor cuenta como "stock bajo" en el panel
+    LOW_STOCK_THRESHOLD = int(os.environ.get('LOW_STOCK_THRESHOLD', 2))
     
-app = Flask(__name__)
-app.config.from_object(Config)
-
-# Asegura que el directorio de subidas exista
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
-
 # Configura la convención de nombres para las restricciones
 convention = {
     "ix": 'ix_%(column_0_label)s',
@@ -41,8 +77,15 @@ convention = {
 }
 
 metadata = MetaData(naming_convention=convention)
-db = SQLAlchemy(app, metadata=metadata)
-migrate = Migrate(app, db)
+db = SQLAlchemy(metadata=metadata)
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignora ON DELETE CASCADE si no se activan las claves externas en cada conexión
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
 
 # --- 2. Modelos de la Base de Datos (SQLAlchemy) ---
@@ -51,7 +94,7 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), default='tecnico')
-    branch = db.Column(db.String(50), nullable=True, default='Sucursal Principal')
+    branch = db.Column(db.String(50), nullable=True, default='Sucursal Principal', index=True)
     
     registered_devices = db.relationship(
         'Device', 
@@ -78,14 +121,15 @@ class Device(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     tracking_code = db.Column(db.String(20), unique=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) 
-    assigned_technician_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True) 
-    branch = db.Column(db.String(50), nullable=False, default='Sucursal Principal')
+    assigned_technician_id = db.column_property(db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True), active_history=True)
+    # active_history conserva el valor anterior al modificarlos, para ajustar los contadores del panel
+    branch = db.column_property(db.Column(db.String(50), nullable=False, default='Sucursal Principal'), active_history=True)
     brand = db.Column(db.String(100), nullable=False)
     model = db.Column(db.String(100), nullable=False)
     serial_number = db.Column(db.String(100), unique=True, nullable=True)
     problem_description = db.Column(db.Text, nullable=False)
     initial_condition_photo_path = db.Column(db.String(512), nullable=True)
-    current_status = db.Column(db.Enum('Ingresado', 'Observacion', 'Reparacion', 'Terminado', 'Retirado', name='status_enum'), default='Ingresado')
+    current_status = db.column_property(db.Column(db.Enum('Ingresado', 'Observacion', 'Reparacion', 'Terminado', 'Retirado', name='status_enum'), default='Ingresado'), active_history=True)
     
     customer_full_name = db.Column(db.String(100), nullable=False)
     customer_id_number = db.Column(db.String(20), nullable=True)
@@ -93,13 +137,22 @@ class Device(db.Model):
     customer_phone = db.Column(db.String(20), nullable=False)
     customer_email = db.Column(db.String(100), nullable=True)
     reception_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    repairs = db.relationship('Repair', backref='device', lazy=True)
+    repairs = db.relationship('Repair', backref='device', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
     final_price = db.Column(db.Float, nullable=True)
     delivery_date = db.Column(db.DateTime, nullable=True)
+    # Versión del equipo para la caché de fragmentos; también cambia al modificar sus reparaciones
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_device_current_status_delivery_date', 'current_status', 'delivery_date'),
+        # Cada sucursal consulta solo sus filas: listados por fecha de ingreso y reportes por fecha de entrega
+        db.Index('ix_device_branch_status_reception_date', 'branch', 'current_status', 'reception_date'),
+        db.Index('ix_device_branch_status_delivery_date', 'branch', 'current_status', 'delivery_date'),
+    )
 
 class Repair(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    device_id = db.Column(db.Integer, db.ForeignKey('device.id'), nullable=False)
+    device_id = db.Column(db.Integer, db.ForeignKey('device.id', ondelete='CASCADE'), nullable=False, index=True)
     description = db.Column(db.Text, nullable=False)
     start_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     end_date = db.Column(db.DateTime, nullable=True)
@@ -108,27 +161,293 @@ class Repair(db.Model):
     cost = db.Column(db.Float, nullable=False, default=0.0)
     price_to_customer = db.Column(db.Float, nullable=False, default=0.0)
     repair_photo_path = db.Column(db.String(255), nullable=True) 
-    components_used = db.relationship('RepairComponent', backref='repair', lazy=True)
+    components_used = db.relationship('RepairComponent', backref='repair', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
 class Component(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
-    stock_quantity = db.Column(db.Integer, nullable=False, default=0)
-    price = db.Column(db.Float, nullable=False)
+    # Saldo actual; solo se modifica a través de record_stock_movement (ver StockMovement)
+    stock_quantity = db.column_property(db.Column(db.Integer, nullable=False, default=0, index=True), active_history=True)
+    price = db.column_property(db.Column(db.Float, nullable=False), active_history=True)
     repairs_used_in = db.relationship('RepairComponent', backref='component', lazy=True)
+    movements = db.relationship('StockMovement', backref='component', lazy='dynamic')
 
 class RepairComponent(db.Model):
-    repair_id = db.Column(db.Integer, db.ForeignKey('repair.id'), primary_key=True)
+    repair_id = db.Column(db.Integer, db.ForeignKey('repair.id', ondelete='CASCADE'), primary_key=True)
     component_id = db.Column(db.Integer, db.ForeignKey('component.id'), primary_key=True)
     quantity_used = db.Column(db.Integer, nullable=False, default=1)
 
+class StatusEvent(db.Model):
+    """Registro de cambios de estado que alimenta el canal SSE (compartido entre workers)."""
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.Integer, nullable=False, index=True)
+    tracking_code = db.Column(db.String(20), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False)
+    action = db.Column(db.String(30), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class Job(db.Model):
+    """Trabajo pendiente de la cola en segundo plano (se procesa con `flask worker`)."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    idempotency_key = db.Column(db.String(120), unique=True, nullable=True)
+    status = db.Column(db.Enum('pending', 'running', 'done', 'failed', name='job_status_enum'), nullable=False, default='pending', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    last_error = db.Column(db.Text, nullable=True)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class KpiCounter(db.Model):
+    """Contador del panel de control; se actualiza en la misma transacción que el cambio que lo afecta."""
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class StockMovement(db.Model):
+    """Movimiento de stock (solo se agregan filas): ingreso, consumo en una reparación o ajuste."""
+    id = db.Column(db.Integer, primary_key=True)
+    component_id = db.Column(db.Integer, db.ForeignKey('component.id'), nullable=False)
+    kind = db.Column(db.Enum('receipt', 'consumption', 'adjustment', name='stock_movement_kind_enum'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    balance_after = db.Column(db.Integer, nullable=False)
+    unit_cost = db.Column(db.Float, nullable=True)
+    repair_id = db.Column(db.Integer, db.ForeignKey('repair.id', ondelete='SET NULL'), nullable=True, index=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    reference = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    repair = db.relationship('Repair')
+    user = db.relationship('User', primaryjoin='foreign(StockMovement.user_id) == User.id')
+
+    __table_args__ = (
+        db.Index('ix_stock_movement_component_id_created_at', 'component_id', 'created_at'),
+    )
+
+class DeviceTombstone(db.Model):
+    """Rastro de un equipo eliminado o archivado, para que los clientes de la API lo quiten al sincronizar."""
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.Integer, nullable=False)
+    tracking_code = db.Column(db.String(20), nullable=False)
+    branch = db.Column(db.String(50), nullable=True)
+    reason = db.Column(db.Enum('deleted', 'archived', name='device_tombstone_reason_enum'), nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+BRANCHES = ['Sucursal Principal', 'Sucursal Norte', 'Sucursal Sur']
+
+@event.listens_for(Session, 'before_flush')
+def touch_device_on_repair_change(session, flush_context, instances):
+    """Actualiza Device.updated_at cuando cambian sus reparaciones o los componentes usados."""
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, RepairComponent):
+            obj = obj.repair or session.get(Repair, obj.repair_id)
+        if isinstance(obj, Repair):
+            device = obj.device or session.get(Device, obj.device_id)
+            if device is not None:
+                device.updated_at = datetime.utcnow()
+
+OPEN_STATUSES = ('Ingresado', 'Observacion', 'Reparacion')
+
+def device_kpi_keys(branch, status, technician_id):
+    """Contadores a los que suma un equipo en ese estado: por sucursal/estado y carga del técnico."""
+    keys = [f'status:{branch}:{status}']
+    if technician_id and status in OPEN_STATUSES:
+        keys.append(f'workload:{technician_id}')
+    return keys
+
+def component_kpi_keys(stock_quantity):
+    if stock_quantity is not None and stock_quantity <= current_app.config['LOW_STOCK_THRESHOLD']:
+        return ['low_stock']
+    return []
+
+def component_value_cents(stock_quantity, price):
+    """Valor de inventario de un componente en centavos (los contadores son enteros)."""
+    return int(round((stock_quantity or 0) * (price or 0) * 100))
+
+def apply_kpi_deltas(connection, deltas):
+    """
+    Suma los deltas a los contadores con un upsert atómico (INSERT ... ON CONFLICT DO UPDATE):
+    dos transacciones que crean a la vez el mismo contador nuevo no chocan. Las claves se
+    recorren ordenadas para que todas tomen los bloqueos en el mismo orden.
+    """
+    table = KpiCounter.__table__
+    dialect_insert = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}.get(connection.dialect.name)
+    for key, delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        if dialect_insert is not None:
+            connection.execute(
+                dialect_insert(table).values(key=key, value=delta)
+                .on_conflict_do_update(index_elements=[table.c.key], set_={'value': table.c.value + delta})
+            )
+            continue
+        # Otros motores: UPDATE y, si no había fila, INSERT; si otro la creó antes, se repite el UPDATE
+        increment = update(table).where(table.c.key == key).values(value=table.c.value + delta)
+        if connection.execute(increment).rowcount:
+            continue
+        try:
+            with connection.begin_nested():
+                connection.execute(table.insert().values(key=key, value=delta))
+        except IntegrityError:
+            connection.execute(increment)
+
+def previous_value(state, attribute):
+    history = state.attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(state.object, attribute)
+
+@event.listens_for(Session, 'after_flush')
+def track_kpi_counters(session, flush_context):
+    """Ajusta los contadores del panel según los equipos y componentes creados, modificados o borrados."""
+    deltas = defaultdict(int)
+    for obj in session.new:
+        if isinstance(obj, Device):
+            for key in device_kpi_keys(obj.branch, obj.current_status, obj.assigned_technician_id):
+                deltas[key] += 1
+        elif isinstance(obj, Component):
+            for key in component_kpi_keys(obj.stock_quantity):
+                deltas[key] += 1
+            deltas['inventory_value_cents'] += component_value_cents(obj.stock_quantity, obj.price)
+    for obj in session.dirty:
+        state = inspect(obj)
+        if isinstance(obj, Device):
+            old_keys = device_kpi_keys(previous_value(state, 'branch'), previous_value(state, 'current_status'),
+                                       previous_value(state, 'assigned_technician_id'))
+            new_keys = device_kpi_keys(obj.branch, obj.current_status, obj.assigned_technician_id)
+        elif isinstance(obj, Component):
+            old_stock = previous_value(state, 'stock_quantity')
+            old_keys = component_kpi_keys(old_stock)
+            new_keys = component_kpi_keys(obj.stock_quantity)
+            deltas['inventory_value_cents'] += (
+                component_value_cents(obj.stock_quantity, obj.price)
+                - component_value_cents(old_stock, previous_value(state, 'price'))
+            )
+        else:
+            continue
+        for key in old_keys:
+            deltas[key] -= 1
+        for key in new_keys:
+            deltas[key] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Device):
+            for key in device_kpi_keys(obj.branch, obj.current_status, obj.assigned_technician_id):
+                deltas[key] -= 1
+        elif isinstance(obj, Component):
+            for key in component_kpi_keys(obj.stock_quantity):
+                deltas[key] -= 1
+            deltas['inventory_value_cents'] -= component_value_cents(obj.stock_quantity, obj.price)
+    if any(deltas.values()):
+        apply_kpi_deltas(session.connection(), deltas)
+
+def reconcile_kpi_counters():
+    """Recalcula todos los contadores desde las tablas y los reemplaza (corrige cualquier desvío)."""
+    counts = defaultdict(int)
+    for branch, status, total in db.session.query(
+        Device.branch, Device.current_status, func.count(Device.id)
+    ).group_by(Device.branch, Device.current_status):
+        counts[f'status:{branch}:{status}'] = total
+    for technician_id, total in db.session.query(
+        Device.assigned_technician_id, func.count(Device.id)
+    ).filter(
+        Device.assigned_technician_id.isnot(None), Device.current_status.in_(OPEN_STATUSES)
+    ).group_by(Device.assigned_technician_id):
+        counts[f'workload:{technician_id}'] = total
+    counts['low_stock'] = Component.query.filter(
+        Component.stock_quantity <= current_app.config['LOW_STOCK_THRESHOLD']
+    ).count()
+    counts['inventory_value_cents'] = int(round(
+        (db.session.query(func.sum(Component.stock_quantity * Component.price)).scalar() or 0) * 100
+    ))
+
+    db.session.execute(delete(KpiCounter))
+    if counts:
+        db.session.execute(KpiCounter.__table__.insert(), [{'key': k, 'value': v} for k, v in counts.items()])
+    db.session.commit()
+    return counts
+
+def count_overdue_pickups(branch=None):
+    """
+    Retiros vencidos: terminados hace más de 5 días (plazo de garantía) y todavía no entregados.
+    Depende de la fecha actual y no de un cambio en la base, por eso se cuenta al consultar en
+    lugar de mantener un contador; solo recorre los equipos en estado Terminado.
+    """
+    last_repair_date_subquery = select(func.max(Repair.end_date)).where(
+        Repair.device_id == Device.id, Repair.status == 'Terminado'
+    ).scalar_subquery()
+    query = db.session.query(func.count(Device.id)).filter(
+        Device.current_status == 'Terminado',
+        last_repair_date_subquery <= datetime.utcnow() - timedelta(days=5)
+    )
+    return filter_devices_by_branch(query, branch).scalar()
+
+STATUS_BADGES = {'Ingresado': 'secondary', 'Observacion': 'warning', 'Reparacion': 'info', 'Terminado': 'success', 'Retirado': 'dark'}
+
+class FragmentCache:
+    """Caché LRU en memoria (por worker) del HTML renderizado de fragmentos de plantillas."""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class FragmentCacheExtension(Extension):
+    """
+    Etiqueta `{% cache 'nombre', clave, ... %}...{% endcache %}` para Jinja. Las claves deben
+    incluir la versión de la entidad (p. ej. device.updated_at), así nunca hace falta invalidar.
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_cache_support', [nodes.Tuple(keys, 'load')]), [], [], body
+        ).set_lineno(lineno)
+
+    def _cache_support(self, key, caller):
+        cache = getattr(self.environment, 'fragment_cache', None)
+        if cache is None:
+            return caller()
+        rv = cache.get(key)
+        if rv is None:
+            rv = caller()
+            cache.set(key, rv)
+        return rv
+
+# Todas las rutas y comandos se registran en este blueprint; create_app() lo monta en la aplicación
+bp = Blueprint('main', __name__, cli_group=None)
+
 # --- 3. Funciones de Utilidad y Decoradores ---
 def requires_login(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         if not session.get('logged_in'):
             flash('Por favor, inicia sesión para acceder a esta página.', 'warning')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         return f(*args, **kwargs)
     return wrapper
 
@@ -138,33 +457,650 @@ def requires_roles(*roles):
         def wrapped(*args, **kwargs):
             if 'username' not in session or session.get('role') not in roles:
                 flash('No tienes permiso para acceder a esta página. Por favor, inicia sesión con una cuenta válida.', 'error')
-                return redirect(url_for('login'))
+                return redirect(url_for('main.login'))
+            return f(*args, **kwargs)
+        return wrapped
+    return wrapper
+
+def api_requires_roles(*roles):
+    """Como requires_roles, pero responde 401/403 en JSON en lugar de redirigir al login."""
+    def wrapper(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            if 'username' not in session:
+                return jsonify(error='No autenticado.'), 401
+            if session.get('role') not in roles:
+                return jsonify(error='Sin permiso.'), 403
             return f(*args, **kwargs)
         return wrapped
     return wrapper
 
+def record_status_event(device, action):
+    """Agrega un evento de estado a la sesión; se confirma en el mismo commit que el cambio."""
+    db.session.add(StatusEvent(
+        device_id=device.id,
+        tracking_code=device.tracking_code,
+        status=device.current_status,
+        action=action
+    ))
+
+_stream_lock = threading.Lock()
+_stream_counts = {'public': 0, 'staff': 0}
+
+def acquire_stream_slot(channel):
+    """Reserva un lugar en el canal ('public' o 'staff'); devuelve False si el proceso ya llegó al tope."""
+    limit = current_app.config['PUBLIC_STREAM_MAX_CONNECTIONS' if channel == 'public' else 'STAFF_STREAM_MAX_CONNECTIONS']
+    with _stream_lock:
+        if _stream_counts[channel] >= limit:
+            return False
+        _stream_counts[channel] += 1
+        return True
+
+def release_stream_slot(channel):
+    with _stream_lock:
+        _stream_counts[channel] = max(_stream_counts[channel] - 1, 0)
+
+def prune_status_events(before):
+    """
+    Borra los eventos de estado anteriores a `before`; devuelve cuántos se borraron. Siempre
+    conserva el último: SQLite reutiliza el id más alto tras un borrado y los navegadores
+    reconectan con Last-Event-ID, así que los ids no pueden volver a empezar.
+    """
+    newest_id = db.session.query(func.max(StatusEvent.id)).scalar()
+    if newest_id is None:
+        return 0
+    deleted = db.session.execute(delete(StatusEvent).where(
+        StatusEvent.created_at < before, StatusEvent.id < newest_id
+    )).rowcount
+    db.session.commit()
+    return deleted
+
+def stream_status_events(tracking_code=None, device_id=None, public=False):
+    """
+    Respuesta SSE que emite los StatusEvent nuevos. Se consulta la tabla por id creciente,
+    así funciona con varios workers; la conexión se cierra tras STATUS_STREAM_MAX_SECONDS
+    (PUBLIC_STREAM_MAX_SECONDS en el canal público) y el navegador se reconecta solo usando
+    Last-Event-ID. Con workers gthread cada conexión ocupa un hilo, por eso ambos canales tienen
+    un tope de conexiones por proceso: al superarlo se responde con un `retry` largo y se cierra.
+    """
+    poll_seconds = current_app.config['STATUS_STREAM_POLL_SECONDS']
+    max_seconds = current_app.config['PUBLIC_STREAM_MAX_SECONDS' if public else 'STATUS_STREAM_MAX_SECONDS']
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+    channel = 'public' if public else 'staff'
+    if not acquire_stream_slot(channel):
+        return Response('retry: 60000\n\n', mimetype='text/event-stream', headers=headers)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_id = int(last_event_id)
+    except (TypeError, ValueError):
+        last_id = db.session.query(func.max(StatusEvent.id)).scalar() or 0
+
+    def build_query(after_id):
+        query = StatusEvent.query.filter(StatusEvent.id > after_id)
+        if tracking_code:
+            query = query.filter(StatusEvent.tracking_code == tracking_code)
+        if device_id:
+            query = query.filter(StatusEvent.device_id == device_id)
+        return query.order_by(StatusEvent.id).limit(100)
+
+    def generate():
+        nonlocal last_id
+        started = last_write = time.monotonic()
+        yield 'retry: 5000\n\n'
+        while time.monotonic() - started < max_seconds:
+            payloads = []
+            for event in build_query(last_id).all():
+                data = {'tracking_code': event.tracking_code, 'status': event.status}
+                if not public:
+                    data.update(device_id=event.device_id, action=event.action,
+                                created_at=event.created_at.isoformat())
+                payloads.append((event.id, data))
+            # Libera la conexión a la base de datos mientras el cliente espera
+            db.session.remove()
+
+            for event_id, data in payloads:
+                last_id = event_id
+                last_write = time.monotonic()
+                yield f'id: {event_id}\nevent: status\ndata: {json.dumps(data)}\n\n'
+            # Comentario periódico para que los proxies no cierren la conexión inactiva
+            if time.monotonic() - last_write >= 15:
+                last_write = time.monotonic()
+                yield ': keep-alive\n\n'
+            time.sleep(poll_seconds)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+    # close() se llama siempre al terminar la respuesta, aunque el cliente corte antes
+    response.call_on_close(lambda: release_stream_slot(channel))
+    return response
+
+def selected_branch():
+    """
+    Sucursal por la que se filtran listados, reportes y exportaciones: por defecto la del
+    usuario. Un admin puede elegir otra con ?branch= (vacío = todas las sucursales).
+    """
+    branch = session.get('branch')
+    if session.get('role') == 'admin' and 'branch' in request.args:
+        branch = request.args.get('branch') or None
+    return branch
+
+def filter_devices_by_branch(query, branch):
+    if branch:
+        return query.filter(Device.branch == branch)
+    return query
+
+def filter_devices_by_search(query, search_query):
+    """Aplica el filtro del buscador de equipos (ID exacto o texto parcial) a una consulta."""
+    if not search_query:
+        return query
+    try:
+        device_id = int(search_query)
+        return query.filter(Device.id == device_id)
+    except ValueError:
+        search_term = f"%{search_query}%"
+        return query.filter(
+            (Device.tracking_code.ilike(search_term)) |
+            (Device.customer_full_name.ilike(search_term)) |
+            (Device.customer_id_number.ilike(search_term)) |
+            (Device.brand.ilike(search_term)) |
+            (Device.model.ilike(search_term))
+        )
+
+DATE_FORMAT_ERROR = 'Las fechas deben tener el formato AAAA-MM-DD.'
+
+def parse_date_range():
+    """
+    Lee `start` y `end` (AAAA-MM-DD) de la URL; `end` incluye el día completo.
+    Lanza ValueError si alguna no tiene el formato correcto.
+    """
+    start = end = None
+    if request.args.get('start'):
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d')
+    if request.args.get('end'):
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1)
+    return start, end
+
+def filter_by_date_range(query, column, start, end):
+    if start:
+        query = query.filter(column >= start)
+    if end:
+        query = query.filter(column < end)
+    return query
+
+def export_rows(statement):
+    """Itera las filas de la consulta con un cursor del lado del servidor, en bloques de 1000."""
+    result = db.session.execute(statement.execution_options(yield_per=1000, stream_results=True))
+    try:
+        for row in result:
+            yield row
+    finally:
+        result.close()
+
+def export_response(filename, header, statement, export_format='csv'):
+    """
+    Descarga los resultados de `statement` como CSV (transmitido fila a fila) o XLSX.
+    La memoria usada no depende de la cantidad de filas.
+    """
+    if export_format == 'xlsx':
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            flash('La exportación a Excel requiere instalar openpyxl.', 'warning')
+            return redirect(request.referrer or url_for('main.admin_dashboard'))
+        # El modo write_only vuelca las filas a disco a medida que se agregan
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(header)
+        for row in export_rows(statement):
+            sheet.append(list(row))
+        tmp = tempfile.TemporaryFile()
+        workbook.save(tmp)
+        tmp.seek(0)
+        return send_file(
+            tmp,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=f'{filename}.xlsx'
+        )
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # BOM para que Excel detecte UTF-8 (acentos y ñ)
+        buffer.write('\ufeff')
+        writer.writerow(header)
+        for count, row in enumerate(export_rows(statement), start=1):
+            writer.writerow(row)
+            if count % 500 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}.csv'}
+    )
+
+def repair_cost_subquery():
+    return select(func.coalesce(func.sum(Repair.cost), 0.0)).where(Repair.device_id == Device.id).scalar_subquery()
+
+def record_stock_movement(component, kind, quantity, unit_cost=None, repair_id=None, reference=None):
+    """
+    Registra un movimiento en el libro de stock y actualiza el saldo del componente.
+    `quantity` lleva signo (negativo en consumos). No hace commit.
+    """
+    component.stock_quantity = (component.stock_quantity or 0) + quantity
+    movement = StockMovement(
+        component=component,
+        kind=kind,
+        quantity=quantity,
+        balance_after=component.stock_quantity,
+        unit_cost=unit_cost if unit_cost is not None else component.price,
+        repair_id=repair_id,
+        user_id=session.get('user_id') if has_request_context() else None,
+        reference=reference
+    )
+    db.session.add(movement)
+    return movement
+
+def is_low_stock(component):
+    return component.stock_quantity <= current_app.config['LOW_STOCK_THRESHOLD']
+
+def import_stock_rows(rows, reference, batch_size=500):
+    """
+    Registra ingresos de stock desde las filas de un archivo de proveedor (columnas
+    nombre, cantidad y opcionalmente precio). Busca los componentes de cada bloque con una
+    sola consulta y crea los que no existen si la fila trae precio. Devuelve (importadas, errores).
+    """
+    imported = 0
+    errors = []
+
+    def flush_batch(batch):
+        nonlocal imported
+        names = {name for _, name, _, _ in batch}
+        # Bloquea las filas del bloque y relee el stock (como en manage_components): sumar sobre
+        # un saldo ya cargado en la sesión pisaría un consumo confirmado mientras tanto
+        components = {c.name: c for c in Component.query.filter(Component.name.in_(names)).order_by(Component.id)
+                      .with_for_update().populate_existing()}
+        for line_number, name, quantity, price in batch:
+            component = components.get(name)
+            if component is None:
+                if price is None:
+                    errors.append(f'Línea {line_number}: el componente "{name}" no existe y no tiene precio.')
+                    continue
+                component = Component(name=name, stock_quantity=0, price=price)
+                db.session.add(component)
+                components[name] = component
+            elif price is not None:
+                component.price = price
+            record_stock_movement(component, 'receipt', quantity, unit_cost=price, reference=reference)
+            imported += 1
+        db.session.commit()
+
+    batch = []
+    for line_number, row in enumerate(rows, start=2):
+        name = (row.get('nombre') or row.get('name') or '').strip()
+        try:
+            quantity = int(row.get('cantidad') or row.get('quantity') or '')
+            price_value = (row.get('precio') or row.get('price') or '').strip()
+            price = float(price_value) if price_value else None
+        except ValueError:
+            errors.append(f'Línea {line_number}: cantidad o precio inválidos.')
+            continue
+        if not name or quantity <= 0:
+            errors.append(f'Línea {line_number}: falta el nombre o la cantidad no es positiva.')
+            continue
+        batch.append((line_number, name, quantity, price))
+        if len(batch) >= batch_size:
+            flush_batch(batch)
+            batch = []
+    if batch:
+        flush_batch(batch)
+    return imported, errors
+
+# --- COLA DE TRABAJOS EN SEGUNDO PLANO ---
+JOB_HANDLERS = {}
+
+def job_handler(kind):
+    """Registra la función que procesa los trabajos de tipo `kind`."""
+    def wrapper(f):
+        JOB_HANDLERS[kind] = f
+        return f
+    return wrapper
+
+def enqueue_job(kind, payload, idempotency_key=None):
+    """
+    Agrega un trabajo a la sesión actual; queda en cola cuando el llamador hace commit.
+    Si hay un trabajo pendiente o en curso con la misma clave de idempotencia, se devuelve ese.
+    Uno ya terminado (o fallido) libera la clave: los ids de SQLite se reutilizan tras un borrado
+    y la misma clave puede referirse a otro registro.
+    """
+    if idempotency_key:
+        existing = Job.query.filter_by(idempotency_key=idempotency_key).first()
+        if existing and existing.status in ('pending', 'running'):
+            return existing
+        if existing:
+            existing.idempotency_key = None
+            db.session.flush()
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload),
+        idempotency_key=idempotency_key,
+        max_attempts=current_app.config['JOB_MAX_ATTEMPTS']
+    )
+    db.session.add(job)
+    return job
+
+def claim_next_job():
+    """Toma el siguiente trabajo disponible; el UPDATE condicional evita que dos workers tomen el mismo."""
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=current_app.config['JOB_LOCK_TIMEOUT_SECONDS'])
+    while True:
+        candidate_id = db.session.query(Job.id).filter(
+            ((Job.status == 'pending') & (Job.run_after <= now)) |
+            ((Job.status == 'running') & (Job.locked_at < stale_before))
+        ).order_by(Job.id).limit(1).scalar()
+        if candidate_id is None:
+            return None
+        claimed = Job.query.filter(
+            Job.id == candidate_id,
+            ((Job.status == 'pending') | ((Job.status == 'running') & (Job.locked_at < stale_before)))
+        ).update({'status': 'running', 'locked_at': now, 'attempts': Job.attempts + 1}, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, candidate_id)
+
+def run_job(job):
+    """Ejecuta un trabajo ya tomado y registra el resultado o programa el reintento."""
+    try:
+        handler = JOB_HANDLERS[job.kind]
+        handler(**json.loads(job.payload))
+        job.status = 'done'
+        job.last_error = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job.id)
+        job.last_error = f'{type(e).__name__}: {e}'
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        else:
+            job.status = 'pending'
+            job.run_after = datetime.utcnow() + timedelta(seconds=current_app.config['JOB_RETRY_BASE_SECONDS'] * 2 ** (job.attempts - 1))
+        db.session.commit()
+
+def work_off_jobs(app):
+    """Procesa trabajos hasta vaciar la cola; devuelve cuántos se ejecutaron."""
+    processed = 0
+    with app.app_context():
+        try:
+            while True:
+                job = claim_next_job()
+                if job is None:
+                    return processed
+                run_job(job)
+                processed += 1
+        finally:
+            db.session.remove()
+
+def save_upload(file, filename):
+    """
+    Guarda la subida tal cual en la carpeta de entrada y encola su optimización: el worker
+    la reduce y recomprime antes de dejarla en UPLOAD_FOLDER.
+    """
+    file.save(os.path.join(current_app.config['UPLOAD_INCOMING_FOLDER'], filename))
+    enqueue_job('store_upload', {'filename': filename}, idempotency_key=f'store_upload:{filename}')
+
+def render_qr_png(data):
+    """Genera el código QR del ticket como PNG."""
+    # qrcode (y Pillow) se importan recién aquí para no cargarlos al iniciar cada worker
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=5,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+def qr_cache_path(tracking_code):
+    return os.path.join(current_app.config['QR_CACHE_FOLDER'], f'{secure_filename(tracking_code)}.png')
+
+def write_file_atomic(path, data):
+    """Escribe en un temporal de la misma carpeta y lo renombra: nadie lee un archivo a medias."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def optimize_photo(source):
+    """
+    Devuelve la foto reducida a UPLOAD_MAX_IMAGE_SIDE píxeles y recomprimida en su mismo
+    formato, o None si no es una imagen que Pillow pueda procesar.
+    """
+    # Pillow se importa recién aquí para no cargarlo al iniciar cada worker
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(source) as img:
+            image_format = img.format
+            img = ImageOps.exif_transpose(img)
+            max_side = current_app.config['UPLOAD_MAX_IMAGE_SIDE']
+            img.thumbnail((max_side, max_side))
+            buffered = io.BytesIO()
+            if image_format == 'JPEG':
+                img.convert('RGB').save(buffered, format='JPEG', quality=current_app.config['UPLOAD_JPEG_QUALITY'], optimize=True)
+            else:
+                img.save(buffered, format=image_format, optimize=True)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+    data = buffered.getvalue()
+    # Si recomprimir no ahorra nada se conserva el original
+    return data if len(data) < os.path.getsize(source) else None
+
+@job_handler('store_upload')
+def store_upload_job(filename):
+    source = os.path.join(current_app.config['UPLOAD_INCOMING_FOLDER'], filename)
+    if not os.path.exists(source):
+        return
+    destination = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    data = optimize_photo(source)
+    if data is None:
+        shutil.move(source, destination)
+    else:
+        write_file_atomic(destination, data)
+        os.remove(source)
+
+def record_device_tombstones(devices, reason):
+    """Agrega (sin commit) un DeviceTombstone por equipo, en la misma transacción que su DELETE."""
+    db.session.execute(insert(DeviceTombstone), [
+        {'device_id': d.id, 'tracking_code': d.tracking_code, 'branch': d.branch, 'reason': reason,
+         'deleted_at': datetime.utcnow()}
+        for d in devices
+    ])
+
+@job_handler('delete_device')
+def delete_device_job(device_id):
+    device = db.session.get(Device, device_id)
+    if device is None:
+        return
+    record_device_tombstones([device], 'deleted')
+    apply_kpi_deltas(db.session.connection(), {
+        key: -1 for key in device_kpi_keys(device.branch, device.current_status, device.assigned_technician_id)
+    })
+    # Las reparaciones y sus componentes se eliminan por ON DELETE CASCADE en la base de datos
+    db.session.execute(delete(Device).where(Device.id == device_id).execution_options(synchronize_session=False))
+
+def device_photo_filenames(device):
+    """Lista de archivos de fotos (ingreso y reparaciones) de un dispositivo."""
+    photos = []
+    if device.initial_condition_photo_path:
+        photos.extend(p.strip() for p in device.initial_condition_photo_path.split(',') if p.strip())
+    for repair in device.repairs:
+        if repair.repair_photo_path:
+            photos.extend(p.strip() for p in repair.repair_photo_path.split(',') if p.strip())
+    return photos
+
+def serialize_device_for_archive(device):
+    row = {column.name: getattr(device, column.name) for column in Device.__table__.columns}
+    row['repairs'] = []
+    for repair in device.repairs:
+        repair_row = {column.name: getattr(repair, column.name) for column in Repair.__table__.columns}
+        repair_row['components'] = [
+            {'component_id': rc.component_id, 'quantity_used': rc.quantity_used}
+            for rc in repair.components_used
+        ]
+        row['repairs'].append(repair_row)
+    return row
+
+def append_archive_batch(archive_path, lines):
+    """
+    Agrega un bloque al archivo como un miembro gzip completo y lo baja a disco (fsync).
+    Varios miembros concatenados siguen siendo un .gz válido para gzip.open y zcat.
+    """
+    is_new = not os.path.exists(archive_path)
+    with open(archive_path, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as gz:
+            gz.write(''.join(lines).encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+    if is_new and os.name == 'posix':
+        # La entrada del directorio también tiene que sobrevivir a un corte
+        dir_fd = os.open(os.path.dirname(archive_path), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def archive_delivered_devices(cutoff, batch_size=500, dry_run=False):
+    """
+    Exporta a un .jsonl.gz los equipos retirados antes de `cutoff` (con reparaciones,
+    componentes y fotos) y los elimina de las tablas activas, de a `batch_size` por transacción.
+    Cada bloque queda escrito y sincronizado en disco antes de su DELETE: si el proceso muere,
+    a lo sumo hay equipos archivados que siguen en la base, nunca borrados sin archivar.
+    Devuelve (cantidad_archivada, ruta_del_archivo).
+    """
+    archive_dir = current_app.config['ARCHIVE_FOLDER']
+    photos_dir = os.path.join(archive_dir, 'photos')
+    os.makedirs(photos_dir, exist_ok=True)
+    archive_path = os.path.join(archive_dir, f"devices_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.jsonl.gz")
+
+    archived = 0
+    last_id = 0
+    while True:
+        devices = Device.query.options(
+            selectinload(Device.repairs).selectinload(Repair.components_used)
+        ).filter(
+            Device.current_status == 'Retirado',
+            Device.delivery_date < cutoff,
+            Device.id > last_id
+        ).order_by(Device.id).limit(batch_size).all()
+        if not devices:
+            break
+        last_id = devices[-1].id
+        archived += len(devices)
+
+        if dry_run:
+            db.session.expunge_all()
+            continue
+
+        ids = [device.id for device in devices]
+        photos = [photo for device in devices for photo in device_photo_filenames(device)]
+        append_archive_batch(archive_path, [
+            json.dumps(serialize_device_for_archive(device), default=str) + '\n' for device in devices
+        ])
+
+        deltas = defaultdict(int)
+        for device in devices:
+            for key in device_kpi_keys(device.branch, device.current_status, device.assigned_technician_id):
+                deltas[key] -= 1
+        apply_kpi_deltas(db.session.connection(), deltas)
+        record_device_tombstones(devices, 'archived')
+        db.session.execute(delete(Device).where(Device.id.in_(ids)).execution_options(synchronize_session=False))
+        db.session.commit()
+        db.session.expunge_all()
+
+        # Las fotos se mueven recién tras el commit: si el bloque falla, los equipos siguen
+        # activos con sus fotos. Se buscan también las que el worker aún no sacó de la entrada.
+        for photo in photos:
+            for folder in (current_app.config['UPLOAD_FOLDER'], current_app.config['UPLOAD_INCOMING_FOLDER']):
+                source = os.path.join(folder, photo)
+                if os.path.exists(source):
+                    shutil.move(source, os.path.join(photos_dir, photo))
+                    break
+
+    if dry_run or not archived:
+        archive_path = None
+    return archived, archive_path
+
+def reassign_and_delete_user(user_id, reassign_to_id):
+    """
+    Reasigna los equipos del usuario con dos UPDATE masivos y lo elimina, sin cargar
+    los dispositivos en memoria. No hace commit: todo queda en la transacción del llamador.
+    Devuelve (equipos_registrados_reasignados, equipos_desasignados).
+    """
+    registered = db.session.execute(
+        update(Device).where(Device.user_id == user_id).values(user_id=reassign_to_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    unassigned = db.session.execute(
+        update(Device).where(Device.assigned_technician_id == user_id).values(assigned_technician_id=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.execute(delete(KpiCounter).where(KpiCounter.key == f'workload:{user_id}'))
+    db.session.execute(delete(User).where(User.id == user_id).execution_options(synchronize_session=False))
+    return registered, unassigned
+
+@job_handler('reconcile_kpis')
+def reconcile_kpis_job():
+    reconcile_kpi_counters()
+
 # --- NUEVA FUNCIÓN PARA SERVIR ARCHIVOS SUBIDOS ---
-@app.route('/static/uploads/<filename>')
+@bp.route('/static/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # Mientras el worker no la haya movido, la foto se sirve desde la carpeta de entrada
+    if not os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], filename)) and \
+            os.path.exists(os.path.join(current_app.config['UPLOAD_INCOMING_FOLDER'], filename)):
+        return send_from_directory(current_app.config['UPLOAD_INCOMING_FOLDER'], filename)
+    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
 
 # --- 4. Rutas de la Aplicación ---
-@app.route('/')
+@bp.route('/')
 def home():
     return render_template('home.html')
 
-@app.context_processor
+@bp.app_context_processor
 def inject_now():
     return {'now': datetime.utcnow()}
 
-@app.route('/track', methods=['GET', 'POST'])
+@bp.app_template_filter('status_badge')
+def status_badge(status):
+    return STATUS_BADGES.get(status, 'secondary')
+
+@bp.route('/track', methods=['GET', 'POST'])
 def track_device():
     device = None
     if request.method == 'POST':
         terms_accepted = request.form.get('terms_acceptance')
         if not terms_accepted:
             flash('Debes aceptar los Términos y Condiciones para ver el estado del dispositivo.', 'warning')
-            return redirect(url_for('track_device'))
+            return redirect(url_for('main.track_device'))
 
         tracking_code = request.form.get('tracking_code')
         customer_id_number = request.form.get('customer_id_number')
@@ -176,7 +1112,7 @@ def track_device():
             flash('Por favor, ingresa tanto el código de seguimiento como el DNI/CUIT.', 'warning')
     return render_template('track_device.html', device=device)
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -189,18 +1125,18 @@ def login():
             session['role'] = user.role
             session['branch'] = user.branch
             flash('Inicio de sesión exitoso.', 'success')
-            return redirect(url_for('admin_dashboard'))
+            return redirect(url_for('main.admin_dashboard'))
         else:
             flash('Nombre de usuario o contraseña incorrectos.', 'error')
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
     flash('Has cerrado sesión exitosamente.', 'info')
-    return redirect(url_for('home'))
+    return redirect(url_for('main.home'))
 
-@app.route('/track/<string:tracking_code>')
+@bp.route('/track/<string:tracking_code>')
 def track_device_status(tracking_code):
     device = Device.query.filter_by(tracking_code=tracking_code).first_or_404()
     warning_message = None
@@ -215,39 +1151,64 @@ def track_device_status(tracking_code):
                 warning_message = f"¡Importante! Tienes {remaining_days} días restantes para retirar tu dispositivo y conservar la garantía."
     return render_template('public_status.html', device=device, warning_message=warning_message, warranty_days_text='5')
 
-@app.route('/ticket/<string:tracking_code>')
+@bp.route('/track/<string:tracking_code>/events')
+def track_device_events(tracking_code):
+    device = Device.query.filter_by(tracking_code=tracking_code).first_or_404()
+    return stream_status_events(tracking_code=device.tracking_code, public=True)
+
+@bp.route('/ticket/<string:tracking_code>')
 def generate_ticket(tracking_code):
     device = Device.query.filter_by(tracking_code=tracking_code).first_or_404()
     warranty_end_date = device.reception_date + timedelta(days=5)
-    terminos_url = url_for('track_device_status', tracking_code=device.tracking_code, _external=True)
-    
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=5,
-        border=4,
-    )
-    qr.add_data(terminos_url)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
 
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    
     return render_template(
         'ticket.html', 
         device=device,
-        warranty_end_date=warranty_end_date.strftime('%d/%m/%Y %H:%M'),
-        qr_terminos=img_str
+        warranty_end_date=warranty_end_date.strftime('%d/%m/%Y %H:%M')
     )
 
-@app.route('/admin')
+@bp.route('/ticket/<string:tracking_code>/qr.png')
+def ticket_qr(tracking_code):
+    """
+    QR del ticket como imagen aparte: la página del ticket responde sin esperar a qrcode y el
+    PNG se genera una sola vez por equipo y queda en QR_CACHE_FOLDER.
+    """
+    device = Device.query.filter_by(tracking_code=tracking_code).first_or_404()
+    qr_path = qr_cache_path(device.tracking_code)
+    if not os.path.exists(qr_path):
+        terminos_url = url_for('main.track_device_status', tracking_code=device.tracking_code, _external=True)
+        write_file_atomic(qr_path, render_qr_png(terminos_url))
+    return send_file(qr_path, mimetype='image/png', max_age=86400)
+
+@bp.route('/admin')
 @requires_roles('admin', 'administrativo', 'vendedor', 'tecnico')
 def admin_dashboard():
-    return render_template('admin_dashboard.html')
-
-@app.route('/admin/devices', methods=['GET'])
+    kpis = None
+    if session.get('role') in ['admin', 'administrativo']:
+        # Unas pocas filas precalculadas, sin importar cuántos equipos haya
+        counters = dict(db.session.query(KpiCounter.key, KpiCounter.value).all())
+        branch = selected_branch()
+        status_counts = {status: 0 for status in STATUS_BADGES}
+        workload = {}
+        for key, value in counters.items():
+            kind, _, rest = key.partition(':')
+            if kind == 'status':
+                counter_branch, _, status = rest.rpartition(':')
+                if not branch or counter_branch == branch:
+                    status_counts[status] = status_counts.get(status, 0) + value
+            elif kind == 'workload' and value:
+                workload[int(rest)] = value
+        technicians = User.query.filter(User.id.in_(workload)).all() if workload else []
+        kpis = {
+            'status_counts': status_counts,
+            'overdue_pickups': count_overdue_pickups(branch),
+            'low_stock': counters.get('low_stock', 0),
+            'workload': sorted(((t.username, workload[t.id]) for t in technicians), key=lambda item: -item[1]),
+            'branch': branch,
+        }
+    return render_template('admin_dashboard.html', kpis=kpis)
+
+@bp.route('/admin/devices', methods=['GET'])
 @requires_roles('admin', 'administrativo', 'tecnico', 'vendedor')
 def list_devices():
     search_query = request.args.get('query', '')
@@ -267,34 +1228,29 @@ def list_devices():
         else_=2
     )
     
-    if search_query:
-        try:
-            device_id = int(search_query)
-            query = query.filter(Device.id == device_id)
-        except ValueError:
-            search_term = f"%{search_query}%"
-            query = query.filter(
-                (Device.tracking_code.ilike(search_term)) |
-                (Device.customer_full_name.ilike(search_term)) |
-                (Device.customer_id_number.ilike(search_term)) |
-                (Device.brand.ilike(search_term)) |
-                (Device.model.ilike(search_term))
-            )
+    branch = selected_branch()
+    query = filter_devices_by_branch(query, branch)
+    query = filter_devices_by_search(query, search_query)
     
     devices = query.order_by(
         priority_order,
         last_repair_date_subquery.asc()
     ).all()
 
-    return render_template('list_devices.html', devices=devices)
+    return render_template('list_devices.html', devices=devices, branches=BRANCHES, selected_branch=branch)
+
+@bp.route('/admin/events/status')
+@requires_roles('admin', 'administrativo', 'tecnico', 'vendedor')
+def status_events():
+    device_id = request.args.get('device_id', type=int)
+    return stream_status_events(device_id=device_id)
 
 # --- GESTION DE USUARIOS ---
-@app.route('/admin/manage_users', methods=['GET', 'POST'])
+@bp.route('/admin/manage_users', methods=['GET', 'POST'])
 @requires_roles('admin')
 def manage_users():
-    users = User.query.all()
     roles = ['admin', 'administrativo', 'vendedor', 'tecnico']
-    branches = ['Sucursal Principal', 'Sucursal Norte', 'Sucursal Sur']
+    branches = BRANCHES
     if request.method == 'POST':
         action = request.form.get('action')
         if action == 'add':
@@ -305,7 +1261,7 @@ def manage_users():
             
             if not username or not password or not role:
                 flash('Por favor, completa todos los campos para crear un usuario.', 'danger')
-                return redirect(url_for('manage_users'))
+                return redirect(url_for('main.manage_users'))
 
             existing_user = User.query.filter_by(username=username).first()
             if existing_user:
@@ -325,29 +1281,22 @@ def manage_users():
             user_id = request.form.get('user_id')
             user_to_delete = User.query.get(user_id)
             if user_to_delete and user_to_delete.username != 'Admin' and user_to_delete.id != session.get('user_id'):
+                username = user_to_delete.username
                 try:
-                    devices_to_reassign = Device.query.filter(
-                        (Device.user_id == user_id) | (Device.assigned_technician_id == user_id)
-                    ).all()
-                    
-                    for device in devices_to_reassign:
-                        if device.user_id == user_id:
-                            device.user_id = session.get('user_id')
-                        if device.assigned_technician_id == user_id:
-                            device.assigned_technician_id = None 
-
-                    db.session.delete(user_to_delete)
+                    registered, unassigned = reassign_and_delete_user(user_to_delete.id, session.get('user_id'))
                     db.session.commit()
-                    flash(f'Usuario "{user_to_delete.username}" eliminado con éxito.', 'success')
+                    flash(f'Usuario "{username}" eliminado con éxito. Equipos reasignados: {registered}. '
+                          f'Equipos sin técnico asignado: {unassigned}.', 'success')
                 except Exception as e:
                     db.session.rollback()
                     flash(f'Error al eliminar el usuario: {str(e)}', 'danger')
             else:
                 flash('No se puede eliminar un usuario administrador o a ti mismo.', 'danger')
 
+    users = User.query.all()
     return render_template('manage_users.html', users=users, roles=roles, branches=branches)
 
-@app.route('/admin/change_password/<int:user_id>', methods=['POST'])
+@bp.route('/admin/change_password/<int:user_id>', methods=['POST'])
 @requires_roles('admin')
 def change_password(user_id):
     user_to_change = User.query.get_or_404(user_id)
@@ -358,13 +1307,22 @@ def change_password(user_id):
         user_to_change.set_password(new_password)
         db.session.commit()
         flash(f'La contraseña del usuario {user_to_change.username} ha sido cambiada con éxito.', 'success')
-    return redirect(url_for('manage_users'))
+    return redirect(url_for('main.manage_users'))
 
 # --- RUTA REFORMULADA DE REPORTE DE INGRESOS ---
-@app.route('/admin/revenue_report')
+@bp.route('/admin/revenue_report')
 @requires_roles('admin', 'administrativo')
 def revenue_report():
-    delivered_devices = Device.query.filter(Device.current_status == 'Retirado').all()
+    try:
+        start, end = parse_date_range()
+    except ValueError:
+        flash(DATE_FORMAT_ERROR, 'warning')
+        start = end = None
+    branch = selected_branch()
+    delivered_devices = filter_by_date_range(
+        filter_devices_by_branch(Device.query, branch).filter(Device.current_status == 'Retirado'),
+        Device.delivery_date, start, end
+    ).all()
     
     monthly_revenue = defaultdict(float)
     weekly_revenue = defaultdict(float)
@@ -399,11 +1357,249 @@ def revenue_report():
         daily_revenue=daily_revenue,
         monthly_profit=monthly_profit,
         weekly_profit=weekly_profit,
-        daily_profit=daily_profit
+        daily_profit=daily_profit,
+        branches=BRANCHES,
+        selected_branch=branch
     )
     
+# --- API JSON v1 ---
+API_DEVICE_FIELDS = {
+    'id': Device.id,
+    'tracking_code': Device.tracking_code,
+    'branch': Device.branch,
+    'current_status': Device.current_status,
+    'customer_full_name': Device.customer_full_name,
+    'customer_id_number': Device.customer_id_number,
+    'customer_phone': Device.customer_phone,
+    'customer_email': Device.customer_email,
+    'brand': Device.brand,
+    'model': Device.model,
+    'serial_number': Device.serial_number,
+    'problem_description': Device.problem_description,
+    'assigned_technician_id': Device.assigned_technician_id,
+    'reception_date': Device.reception_date,
+    'delivery_date': Device.delivery_date,
+    'final_price': Device.final_price,
+    'updated_at': Device.updated_at,
+}
+API_DEFAULT_DEVICE_FIELDS = ['id', 'tracking_code', 'branch', 'current_status', 'customer_full_name',
+                             'brand', 'model', 'reception_date', 'updated_at']
+API_REPAIR_FIELDS = ['id', 'description', 'status', 'start_date', 'end_date', 'cost', 'price_to_customer']
+API_MAX_LIMIT = 500
+API_MAX_BATCH = 200
+
+def api_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def api_device_fields():
+    """Campos pedidos con ?fields=a,b,c; siempre incluye `id`. Devuelve None si alguno no existe."""
+    requested = request.args.get('fields')
+    fields = [f.strip() for f in requested.split(',') if f.strip()] if requested else list(API_DEFAULT_DEVICE_FIELDS)
+    if any(f not in API_DEVICE_FIELDS for f in fields):
+        return None
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields
+
+def api_serialize_devices(statement, fields):
+    """Ejecuta la consulta de columnas y, si se pidió ?include=repairs, carga las reparaciones en una sola consulta."""
+    rows = db.session.execute(statement).all()
+    devices = [{field: api_value(value) for field, value in zip(fields, row)} for row in rows]
+
+    if 'repairs' in request.args.get('include', '').split(',') and devices:
+        by_device = {device['id']: device for device in devices}
+        for device in devices:
+            device['repairs'] = []
+        repair_columns = [getattr(Repair, field) for field in API_REPAIR_FIELDS]
+        repairs = db.session.execute(
+            select(Repair.device_id, *repair_columns).where(Repair.device_id.in_(by_device)).order_by(Repair.id)
+        ).all()
+        for device_id, *values in repairs:
+            by_device[device_id]['repairs'].append(
+                {field: api_value(value) for field, value in zip(API_REPAIR_FIELDS, values)}
+            )
+    return devices
+
+def api_conditional_response(payload):
+    """
+    Respuesta JSON con ETag; devuelve 304 si el cliente ya tiene esta versión. No se envía
+    Last-Modified: la fecha más nueva de una página no cambia si se borra un equipo de ella.
+    """
+    response = jsonify(payload)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@bp.route('/api/v1/devices')
+@api_requires_roles('admin', 'administrativo', 'tecnico', 'vendedor')
+def api_list_devices():
+    """
+    Lista paginada por cursor (?cursor=<último id>&limit=N), con ?fields=, ?include=repairs,
+    ?query= (mismo buscador que el listado), ?status= y ?updated_since= (ISO 8601) para sincronizar.
+    """
+    fields = api_device_fields()
+    if fields is None:
+        return jsonify(error='Campo desconocido.', allowed_fields=sorted(API_DEVICE_FIELDS)), 400
+    cursor = request.args.get('cursor', 0, type=int)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), API_MAX_LIMIT)
+
+    statement = select(*[API_DEVICE_FIELDS[f] for f in fields]).where(Device.id > cursor)
+    statement = filter_devices_by_branch(statement, selected_branch())
+    statement = filter_devices_by_search(statement, request.args.get('query', ''))
+    if request.args.get('status'):
+        statement = statement.where(Device.current_status == request.args['status'])
+    if request.args.get('updated_since'):
+        try:
+            updated_since = datetime.fromisoformat(request.args['updated_since'])
+        except ValueError:
+            return jsonify(error='updated_since debe estar en formato ISO 8601.'), 400
+        statement = statement.where(Device.updated_at > updated_since)
+
+    devices = api_serialize_devices(statement.order_by(Device.id).limit(limit), fields)
+    next_cursor = devices[-1]['id'] if len(devices) == limit else None
+    return api_conditional_response({'data': devices, 'next_cursor': next_cursor})
+
+@bp.route('/api/v1/devices/deleted')
+@api_requires_roles('admin', 'administrativo', 'tecnico', 'vendedor')
+def api_deleted_devices():
+    """
+    Equipos eliminados o archivados desde ?since= (ISO 8601), paginados por cursor como el listado.
+    Junto con ?updated_since= en /api/v1/devices permite sincronizar sin descargar todo de nuevo.
+    Los ids de equipo pueden reutilizarse: el cliente debe comparar también el tracking_code.
+    """
+    cursor = request.args.get('cursor', 0, type=int)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), API_MAX_LIMIT)
+    statement = select(DeviceTombstone).where(DeviceTombstone.id > cursor)
+    branch = selected_branch()
+    if branch:
+        statement = statement.where(DeviceTombstone.branch == branch)
+    if request.args.get('since'):
+        try:
+            since = datetime.fromisoformat(request.args['since'])
+        except ValueError:
+            return jsonify(error='since debe estar en formato ISO 8601.'), 400
+        statement = statement.where(DeviceTombstone.deleted_at > since)
+
+    tombstones = db.session.execute(statement.order_by(DeviceTombstone.id).limit(limit)).scalars().all()
+    data = [{
+        'id': t.device_id,
+        'tracking_code': t.tracking_code,
+        'reason': t.reason,
+        'deleted_at': t.deleted_at.isoformat(),
+    } for t in tombstones]
+    next_cursor = tombstones[-1].id if len(tombstones) == limit else None
+    return api_conditional_response({'data': data, 'next_cursor': next_cursor})
+
+@bp.route('/api/v1/devices/batch', methods=['GET', 'POST'])
+@api_requires_roles('admin', 'administrativo', 'tecnico', 'vendedor')
+def api_batch_devices():
+    """
+    Busca muchos equipos en una sola llamada: ?ids=1,2&tracking_codes=OT-1,OT-2 o un
+    cuerpo JSON {"ids": [...], "tracking_codes": [...]}. Informa en `missing` los que no
+    existen o no pertenecen a la sucursal del usuario.
+    """
+    fields = api_device_fields()
+    if fields is None:
+        return jsonify(error='Campo desconocido.', allowed_fields=sorted(API_DEVICE_FIELDS)), 400
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        if body is None:
+            body = {}
+        if not isinstance(body, dict):
+            return jsonify(error='El cuerpo debe ser un objeto JSON.'), 400
+        ids = body.get('ids') or []
+        tracking_codes = body.get('tracking_codes') or []
+        if not isinstance(ids, list) or not isinstance(tracking_codes, list):
+            return jsonify(error='ids y tracking_codes deben ser listas.'), 400
+    else:
+        ids = [i for i in request.args.get('ids', '').split(',') if i.strip()]
+        tracking_codes = [c.strip() for c in request.args.get('tracking_codes', '').split(',') if c.strip()]
+    if any(isinstance(i, bool) or not isinstance(i, (int, str)) for i in ids):
+        return jsonify(error='Los ids deben ser números enteros.'), 400
+    try:
+        ids = [int(i) for i in ids]
+    except ValueError:
+        return jsonify(error='Los ids deben ser números enteros.'), 400
+    if not all(isinstance(c, str) for c in tracking_codes):
+        return jsonify(error='Los tracking_codes deben ser textos.'), 400
+    if len(ids) + len(tracking_codes) > API_MAX_BATCH:
+        return jsonify(error=f'Se permiten hasta {API_MAX_BATCH} equipos por llamada.'), 400
+    if not ids and not tracking_codes:
+        return jsonify(data=[], missing={'ids': [], 'tracking_codes': []})
+
+    columns = [API_DEVICE_FIELDS[f] for f in fields]
+    if 'tracking_code' not in fields:
+        columns.append(Device.tracking_code)
+    statement = select(*columns).where(Device.id.in_(ids) | Device.tracking_code.in_(tracking_codes)).order_by(Device.id)
+    statement = filter_devices_by_branch(statement, selected_branch())
+    devices = api_serialize_devices(statement, fields + (['tracking_code'] if 'tracking_code' not in fields else []))
+
+    found_ids = {d['id'] for d in devices}
+    found_codes = {d['tracking_code'] for d in devices}
+    if 'tracking_code' not in fields:
+        for device in devices:
+            del device['tracking_code']
+    return api_conditional_response({
+        'data': devices,
+        'missing': {
+            'ids': [i for i in ids if i not in found_ids],
+            'tracking_codes': [c for c in tracking_codes if c not in found_codes],
+        }
+    })
+
+# --- EXPORTACIONES PARA CONTABILIDAD ---
+@bp.route('/admin/export/devices')
+@requires_roles('admin', 'administrativo')
+def export_devices():
+    statement = filter_devices_by_search(select(
+        Device.id, Device.tracking_code, Device.branch, Device.customer_full_name, Device.customer_id_number,
+        Device.customer_phone, Device.customer_email, Device.brand, Device.model, Device.serial_number,
+        Device.current_status, Device.reception_date, Device.delivery_date, Device.final_price
+    ), request.args.get('query', ''))
+    statement = filter_devices_by_branch(statement, selected_branch()).order_by(Device.id)
+    header = ['ID', 'Código', 'Sucursal', 'Cliente', 'DNI/CUIT', 'Teléfono', 'Email', 'Marca', 'Modelo',
+              'N° de Serie', 'Estado', 'Fecha de Ingreso', 'Fecha de Entrega', 'Precio Final']
+    return export_response('equipos', header, statement, request.args.get('format', 'csv'))
+
+@bp.route('/admin/export/repairs')
+@requires_roles('admin', 'administrativo')
+def export_repairs():
+    statement = filter_devices_by_search(select(
+        Repair.id, Device.tracking_code, Device.customer_full_name, Repair.description, Repair.status,
+        Repair.start_date, Repair.end_date, Repair.cost, Repair.price_to_customer
+    ).join(Device, Repair.device_id == Device.id), request.args.get('query', ''))
+    statement = filter_devices_by_branch(statement, selected_branch())
+    try:
+        start, end = parse_date_range()
+    except ValueError:
+        # Una exportación sin filtro traería todo el historial: mejor rechazarla
+        return Response(DATE_FORMAT_ERROR, status=400, mimetype='text/plain')
+    statement = filter_by_date_range(statement, Repair.start_date, start, end).order_by(Repair.id)
+    header = ['ID', 'Código de Equipo', 'Cliente', 'Descripción', 'Estado', 'Fecha de Inicio',
+              'Fecha de Término', 'Costo', 'Precio al Cliente']
+    return export_response('reparaciones', header, statement, request.args.get('format', 'csv'))
+
+@bp.route('/admin/export/revenue')
+@requires_roles('admin', 'administrativo')
+def export_revenue():
+    repair_cost = repair_cost_subquery()
+    statement = select(
+        Device.tracking_code, Device.branch, Device.customer_full_name, Device.delivery_date,
+        Device.final_price, repair_cost, Device.final_price - repair_cost
+    ).filter(Device.current_status == 'Retirado', Device.delivery_date.isnot(None), Device.final_price.isnot(None))
+    statement = filter_devices_by_branch(statement, selected_branch())
+    try:
+        start, end = parse_date_range()
+    except ValueError:
+        # Una exportación sin filtro traería todo el historial: mejor rechazarla
+        return Response(DATE_FORMAT_ERROR, status=400, mimetype='text/plain')
+    statement = filter_by_date_range(statement, Device.delivery_date, start, end).order_by(Device.delivery_date)
+    header = ['Código', 'Sucursal', 'Cliente', 'Fecha de Entrega', 'Cobro', 'Costo de Reparaciones', 'Ganancia Neta']
+    return export_response('ingresos', header, statement, request.args.get('format', 'csv'))
+
 # --- RUTA PARA EDITAR COSTO DE REPARACIÓN ---
-@app.route('/admin/repair/<int:repair_id>/edit_cost', methods=['POST'])
+@bp.route('/admin/repair/<int:repair_id>/edit_cost', methods=['POST'])
 @requires_roles('admin')
 def edit_repair_cost(repair_id):
     repair = Repair.query.get_or_404(repair_id)
@@ -421,9 +1617,9 @@ def edit_repair_cost(repair_id):
             db.session.rollback()
             flash('El costo debe ser un número válido.', 'danger')
     
-    return redirect(url_for('view_device_details', device_id=repair.device_id))
+    return redirect(url_for('main.view_device_details', device_id=repair.device_id))
 
-@app.route('/admin/repair/<int:repair_id>/edit_price', methods=['POST'])
+@bp.route('/admin/repair/<int:repair_id>/edit_price', methods=['POST'])
 @requires_roles('admin')
 def edit_repair_price(repair_id):
     repair = Repair.query.get_or_404(repair_id)
@@ -439,10 +1635,10 @@ def edit_repair_price(repair_id):
             db.session.rollback()
             flash('El precio debe ser un número válido.', 'danger')
     
-    return redirect(url_for('view_device_details', device_id=repair.device_id))
+    return redirect(url_for('main.view_device_details', device_id=repair.device_id))
 
 
-@app.route('/admin/add_device', methods=['GET', 'POST'])
+@bp.route('/admin/add_device', methods=['GET', 'POST'])
 @requires_roles('admin', 'vendedor')
 def add_device():
     if request.method == 'POST':
@@ -462,9 +1658,8 @@ def add_device():
             for file in files:
                 if file and file.filename != '':
                     filename = secure_filename(f"{tracking_code}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{file.filename}")
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(filepath)
-                    photos_urls.append(filename) 
+                    save_upload(file, filename)
+                    photos_urls.append(filename)
 
         initial_photo_path_string = ",".join(photos_urls)
         
@@ -480,21 +1675,21 @@ def add_device():
             tracking_code=tracking_code,
             initial_condition_photo_path=initial_photo_path_string,
             user_id=session.get('user_id'),
-            branch='Sucursal Principal'
+            branch=session.get('branch') or 'Sucursal Principal'
         )
         
         try:
             db.session.add(new_device)
             db.session.commit()
             flash(f'Dispositivo registrado con éxito. Código: {tracking_code}', 'success')
-            return redirect(url_for('generate_ticket', tracking_code=new_device.tracking_code))
+            return redirect(url_for('main.generate_ticket', tracking_code=new_device.tracking_code))
         except Exception as e:
             db.session.rollback()
             flash(f'Error al registrar el dispositivo: {str(e)}', 'error')
             
     return render_template('add_device.html')
 
-@app.route('/admin/device/<int:device_id>/delete', methods=['POST'])
+@bp.route('/admin/device/<int:device_id>/delete', methods=['POST'])
 @requires_roles('admin')
 def delete_device(device_id):
     """
@@ -502,25 +1697,20 @@ def delete_device(device_id):
     """
     device = Device.query.get_or_404(device_id)
     
-    # Inicia la transacción para eliminar el dispositivo y sus reparaciones asociadas
+    # El borrado del dispositivo y sus reparaciones lo hace el worker en segundo plano
     try:
-        # Elimina las reparaciones asociadas para evitar errores de restricción de clave externa
-        for repair in device.repairs:
-            db.session.delete(repair)
-        
-        # Elimina el dispositivo
-        db.session.delete(device)
+        enqueue_job('delete_device', {'device_id': device.id}, idempotency_key=f'delete_device:{device.id}')
         db.session.commit()
         
-        flash(f'El dispositivo con código {device.tracking_code} ha sido eliminado exitosamente.', 'success')
-        return redirect(url_for('admin_dashboard'))
+        flash(f'La eliminación del dispositivo con código {device.tracking_code} fue programada.', 'success')
+        return redirect(url_for('main.admin_dashboard'))
     except Exception as e:
         db.session.rollback()
         flash(f'Ocurrió un error al intentar eliminar el dispositivo: {str(e)}', 'danger')
-        return redirect(url_for('view_device_details', device_id=device.id))
+        return redirect(url_for('main.view_device_details', device_id=device.id))
 
 
-@app.route('/admin/device/<int:device_id>', methods=['GET', 'POST'])
+@bp.route('/admin/device/<int:device_id>', methods=['GET', 'POST'])
 @requires_roles('admin', 'administrativo', 'vendedor', 'tecnico')
 def view_device_details(device_id):
     device = Device.query.get_or_404(device_id)
@@ -532,7 +1722,7 @@ def view_device_details(device_id):
         if action == 'mark_delivered':
             if session.get('role') not in ['admin', 'vendedor']:
                 flash('No tienes permiso para marcar un dispositivo como entregado.', 'error')
-                return redirect(url_for('view_device_details', device_id=device.id))
+                return redirect(url_for('main.view_device_details', device_id=device.id))
             final_price_str = request.form.get('final_price')
             if final_price_str:
                 try:
@@ -540,6 +1730,7 @@ def view_device_details(device_id):
                     device.final_price = final_price
                     device.delivery_date = datetime.utcnow()
                     device.current_status = 'Retirado'
+                    record_status_event(device, 'mark_delivered')
                     db.session.commit()
                     flash(f'Dispositivo entregado exitosamente. Se ha registrado un cobro de ${final_price:.2f}.', 'success')
                 except (ValueError, TypeError):
@@ -550,23 +1741,25 @@ def view_device_details(device_id):
         elif action == 'revert_status':
             if session.get('role') != 'admin':
                 flash('No tienes permiso para revertir el estado del dispositivo.', 'error')
-                return redirect(url_for('view_device_details', device_id=device.id))
+                return redirect(url_for('main.view_device_details', device_id=device.id))
             device.current_status = 'Terminado'
             device.final_price = None
             device.delivery_date = None
+            record_status_event(device, 'revert_status')
             db.session.commit()
             flash('El estado del dispositivo ha sido revertido a "Terminado".', 'info')
 
         elif action == 'assign_technician':
             if session.get('role') not in ['admin', 'administrativo']:
                 flash('No tienes permiso para asignar un técnico.', 'error')
-                return redirect(url_for('view_device_details', device_id=device.id))
+                return redirect(url_for('main.view_device_details', device_id=device.id))
 
             assigned_technician_id = request.form.get('technician_id')
 
             if assigned_technician_id:
                 device.assigned_technician_id = int(assigned_technician_id)
                 device.current_status = 'Observacion'
+                record_status_event(device, 'assign_technician')
                 db.session.commit()
                 flash('Técnico asignado con éxito. El estado ha cambiado a Observación.', 'success')
             else:
@@ -575,46 +1768,26 @@ def view_device_details(device_id):
         elif action == 'update_status':
             if session.get('role') not in ['admin', 'administrativo', 'tecnico']:
                 flash('No tienes permiso para cambiar el estado.', 'error')
-                return redirect(url_for('view_device_details', device_id=device.id))
+                return redirect(url_for('main.view_device_details', device_id=device.id))
 
             new_status = request.form.get('current_status')
             if new_status:
                 device.current_status = new_status
+                record_status_event(device, 'update_status')
                 db.session.commit()
                 flash(f'Estado del dispositivo actualizado a "{new_status}".', 'success')
             else:
                 flash('No se seleccionó un estado válido.', 'warning')
 
-        return redirect(url_for('view_device_details', device_id=device.id))
-
-    return render_template('device_details.html', device=device, technicians=technicians)
-    
-    # Lógica para manejar la solicitud GET
-    # Aquí es donde se construye la lista 'all_photos'
-    all_photos = []
-    if device.initial_condition_photo_path:
-        all_photos.extend(device.initial_condition_photo_path.split(','))
-        
-    for repair in device.repairs:
-        if repair.repair_photo_path:
-            all_photos.extend(repair.repair_photo_path.split(','))
-
-    return render_template('device_details.html', device=device, technicians=technicians, all_photos=all_photos)
-
-    
-    # Lógica para manejar la solicitud GET
-    initial_photos = device.initial_condition_photo_path.split(',') if device.initial_condition_photo_path else []
-    
-    all_photos = list(initial_photos)
-    for repair in device.repairs:
-        if repair.repair_photo_path:
-            repair_photos = repair.repair_photo_path.split(',')
-            for photo_filename in repair_photos:
-                all_photos.append(photo_filename.strip())
+        return redirect(url_for('main.view_device_details', device_id=device.id))
 
-    return render_template('device_details.html', device=device, technicians=technicians, all_photos=all_photos)
+    initial_photos = [p.strip() for p in device.initial_condition_photo_path.split(',') if p.strip()] \
+        if device.initial_condition_photo_path else []
+    all_photos = device_photo_filenames(device)
+    return render_template('device_details.html', device=device, technicians=technicians,
+                           all_photos=all_photos, initial_photos=set(initial_photos))
 
-@app.route('/admin/device/<int:device_id>/add_repair', methods=['GET', 'POST'])
+@bp.route('/admin/device/<int:device_id>/add_repair', methods=['GET', 'POST'])
 @requires_roles('admin', 'administrativo', 'tecnico')
 def add_repair(device_id):
     device = Device.query.get_or_404(device_id)
@@ -630,13 +1803,12 @@ def add_repair(device_id):
             file = request.files['repair_photo']
             if file and file.filename != '':
                 filename = secure_filename(f"{device.tracking_code}_repair_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{file.filename}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
+                save_upload(file, filename)
                 repair_photo_path = filename
                 
         if session.get('role') == 'tecnico' and status not in ['Observacion', 'Reparacion', 'Terminado']:
             flash('Un técnico solo puede cambiar el estado a Observación, Reparación o Terminado.', 'error')
-            return redirect(url_for('view_device_details', device_id=device.id))
+            return redirect(url_for('main.view_device_details', device_id=device.id))
 
         try:
             new_repair = Repair(
@@ -656,10 +1828,11 @@ def add_repair(device_id):
             db.session.commit()
             
             device.current_status = status
+            record_status_event(device, 'add_repair')
             db.session.commit()
             
             flash('Reparación agregada exitosamente.', 'success')
-            return redirect(url_for('view_device_details', device_id=device.id))
+            return redirect(url_for('main.view_device_details', device_id=device.id))
         except ValueError:
             db.session.rollback()
             flash('Costo y precio deben ser números válidos.', 'error')
@@ -669,7 +1842,7 @@ def add_repair(device_id):
             
     return render_template('add_repair.html', device=device)
 
-@app.route('/admin/repair/<int:repair_id>/manage_components', methods=['GET', 'POST'])
+@bp.route('/admin/repair/<int:repair_id>/manage_components', methods=['GET', 'POST'])
 @requires_roles('admin', 'tecnico')
 def manage_components(repair_id):
     repair = Repair.query.get_or_404(repair_id)
@@ -680,8 +1853,10 @@ def manage_components(repair_id):
         quantity_used = request.form.get('quantity_used')
         if not component_id or not quantity_used:
             flash('Por favor, selecciona un componente y la cantidad.', 'warning')
-            return redirect(url_for('manage_components', repair_id=repair.id))
-        component = Component.query.get(int(component_id))
+            return redirect(url_for('main.manage_components', repair_id=repair.id))
+        # Bloquea la fila del componente para que dos consumos simultáneos no dejen stock negativo;
+        # populate_existing vuelve a leer el stock aunque available_components ya lo haya cargado
+        component = db.session.get(Component, int(component_id), with_for_update=True, populate_existing=True)
         if component and component.stock_quantity >= int(quantity_used):
             try:
                 repair_component = RepairComponent.query.filter_by(
@@ -698,13 +1873,15 @@ def manage_components(repair_id):
                     )
                     db.session.add(new_repair_component)
 
-                component.stock_quantity -= int(quantity_used)
-                db.session.add(component)
+                record_stock_movement(component, 'consumption', -int(quantity_used), repair_id=repair.id,
+                                      reference=f'Reparación #{repair.id} ({device.tracking_code})')
                 costo_componente = component.price * int(quantity_used)
                 repair.cost += costo_componente
                 db.session.add(repair)
                 db.session.commit()
                 flash(f'{quantity_used} unidad(es) de {component.name} agregada(s) a la reparación. Costo actualizado.', 'success')
+                if is_low_stock(component):
+                    flash(f'Atención: quedan {component.stock_quantity} unidad(es) de {component.name}.', 'warning')
             except Exception as e:
                 db.session.rollback()
                 flash(f'Error al agregar el componente: {str(e)}', 'error')
@@ -713,13 +1890,88 @@ def manage_components(repair_id):
     
     return render_template('manage_components.html', repair=repair, available_components=available_components)
 
-@app.route('/admin/stock')
+@bp.route('/admin/stock')
 @requires_roles('admin', 'administrativo')
 def manage_stock():
-    components = Component.query.all()
-    return render_template('manage_stock.html', components=components)
+    low_stock_only = request.args.get('low') == '1'
+    query = Component.query
+    if low_stock_only:
+        # Usa el índice de stock_quantity
+        query = query.filter(Component.stock_quantity <= current_app.config['LOW_STOCK_THRESHOLD'])
+    pagination = query.order_by(Component.name).paginate(
+        page=request.args.get('page', 1, type=int), per_page=50, error_out=False
+    )
+    counters = dict(db.session.query(KpiCounter.key, KpiCounter.value).filter(
+        KpiCounter.key.in_(['inventory_value_cents', 'low_stock'])
+    ).all())
+    return render_template(
+        'manage_stock.html',
+        components=pagination.items,
+        pagination=pagination,
+        low_stock_only=low_stock_only,
+        low_stock_threshold=current_app.config['LOW_STOCK_THRESHOLD'],
+        inventory_value=counters.get('inventory_value_cents', 0) / 100,
+        low_stock_count=counters.get('low_stock', 0)
+    )
 
-@app.route('/admin/add_component', methods=['POST'])
+@bp.route('/admin/stock/<int:component_id>/movements')
+@requires_roles('admin', 'administrativo')
+def stock_movements(component_id):
+    component = Component.query.get_or_404(component_id)
+    # El índice (component_id, created_at) resuelve el orden sin ordenar en memoria
+    pagination = component.movements.options(
+        selectinload(StockMovement.repair), selectinload(StockMovement.user)
+    ).order_by(StockMovement.created_at.desc(), StockMovement.id.desc()).paginate(
+        page=request.args.get('page', 1, type=int), per_page=50, error_out=False
+    )
+    return render_template('stock_movements.html', component=component, movements=pagination.items, pagination=pagination)
+
+@bp.route('/admin/stock/<int:component_id>/movement', methods=['POST'])
+@requires_roles('admin', 'administrativo')
+def add_stock_movement(component_id):
+    component = db.session.get(Component, component_id, with_for_update=True, populate_existing=True)
+    if component is None:
+        flash('Componente no válido.', 'error')
+        return redirect(url_for('main.manage_stock'))
+    kind = request.form.get('kind')
+    reference = request.form.get('reference') or None
+    try:
+        quantity = int(request.form.get('quantity', ''))
+        if kind == 'receipt' and quantity > 0:
+            record_stock_movement(component, 'receipt', quantity, reference=reference)
+        elif kind == 'adjustment' and quantity >= 0:
+            # En los ajustes se ingresa la cantidad contada; se registra la diferencia
+            difference = quantity - component.stock_quantity
+            if difference:
+                record_stock_movement(component, 'adjustment', difference, reference=reference or 'Conteo de inventario')
+        else:
+            raise ValueError
+        db.session.commit()
+        flash(f'Stock de {component.name} actualizado: {component.stock_quantity} unidad(es).', 'success')
+    except ValueError:
+        db.session.rollback()
+        flash('La cantidad debe ser un número válido.', 'error')
+    return redirect(request.referrer or url_for('main.manage_stock'))
+
+@bp.route('/admin/stock/import', methods=['POST'])
+@requires_roles('admin', 'administrativo')
+def import_stock():
+    file = request.files.get('restock_file')
+    if not file or file.filename == '':
+        flash('Selecciona un archivo CSV del proveedor.', 'warning')
+        return redirect(url_for('main.manage_stock'))
+    try:
+        rows = csv.DictReader(io.TextIOWrapper(file.stream, encoding='utf-8-sig'))
+        imported, errors = import_stock_rows(rows, reference=f'Importación {secure_filename(file.filename)}')
+        flash(f'{imported} ingreso(s) de stock importados.', 'success')
+        for error in errors[:10]:
+            flash(error, 'warning')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al importar el archivo: {str(e)}', 'error')
+    return redirect(url_for('main.manage_stock'))
+
+@bp.route('/admin/add_component', methods=['POST'])
 @requires_roles('admin', 'administrativo')
 def add_component():
     name = request.form.get('name')
@@ -729,10 +1981,12 @@ def add_component():
         try:
             new_component = Component(
                 name=name,
-                stock_quantity=int(stock_quantity),
+                stock_quantity=0,
                 price=float(price)
             )
             db.session.add(new_component)
+            if int(stock_quantity):
+                record_stock_movement(new_component, 'receipt', int(stock_quantity), reference='Alta del componente')
             db.session.commit()
             flash('Componente agregado exitosamente.', 'success')
         except Exception as e:
@@ -740,40 +1994,206 @@ def add_component():
             flash(f'Error al agregar el componente: {str(e)}', 'error')
     else:
         flash('Faltan datos para agregar el componente.', 'warning')
-    return redirect(url_for('manage_stock'))
+    return redirect(url_for('main.manage_stock'))
+
+@bp.route('/admin/jobs')
+@requires_roles('admin')
+def list_jobs():
+    status_filter = request.args.get('status', '')
+    query = Job.query
+    if status_filter:
+        query = query.filter(Job.status == status_filter)
+    jobs = query.order_by(Job.id.desc()).limit(200).all()
+    counts = dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+    return render_template('jobs.html', jobs=jobs, counts=counts, status_filter=status_filter)
+
+@bp.route('/admin/jobs/<int:job_id>/retry', methods=['POST'])
+@requires_roles('admin')
+def retry_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.status == 'failed':
+        job.status = 'pending'
+        job.attempts = 0
+        job.run_after = datetime.utcnow()
+        job.finished_at = None
+        db.session.commit()
+        flash(f'Trabajo #{job.id} reprogramado.', 'success')
+    return redirect(url_for('main.list_jobs'))
+
+
+# --- 5. Comandos de Consola ---
+@bp.cli.command('worker')
+@click.option('--concurrency', default=2, show_default=True, help='Cantidad de hilos que procesan trabajos.')
+@click.option('--burst', is_flag=True, help='Vacía la cola y termina en lugar de quedar esperando.')
+@click.option('--poll-interval', default=2.0, show_default=True, help='Segundos de espera cuando la cola está vacía.')
+def worker_command(concurrency, burst, poll_interval):
+    """Procesa la cola de trabajos en segundo plano."""
+    app = current_app._get_current_object()
+    click.echo(f'Worker iniciado con {concurrency} hilo(s).')
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            processed = sum(pool.map(lambda _: work_off_jobs(app), range(concurrency)))
+            if processed:
+                click.echo(f'{processed} trabajo(s) procesado(s).')
+            elif burst:
+                break
+            else:
+                time.sleep(poll_interval)
+    click.echo('Cola vacía, worker detenido.')
+
+
+@bp.cli.command('archive-devices')
+@click.option('--months', default=12, show_default=True, help='Antigüedad mínima de la entrega, en meses.')
+@click.option('--batch-size', default=500, show_default=True, help='Equipos por transacción.')
+@click.option('--dry-run', is_flag=True, help='Solo cuenta los equipos que se archivarían.')
+def archive_devices_command(months, batch_size, dry_run):
+    """Archiva los equipos retirados hace más de N meses y los quita de las tablas activas."""
+    cutoff = datetime.utcnow() - timedelta(days=30 * months)
+    archived, archive_path = archive_delivered_devices(cutoff, batch_size=batch_size, dry_run=dry_run)
+    if dry_run:
+        click.echo(f'{archived} equipo(s) entregados antes del {cutoff:%d/%m/%Y} serían archivados.')
+    elif archived:
+        click.echo(f'{archived} equipo(s) archivados en {archive_path}.')
+    else:
+        click.echo('No hay equipos para archivar.')
+    if not dry_run:
+        retention = timedelta(days=current_app.config['STATUS_EVENT_RETENTION_DAYS'])
+        pruned = prune_status_events(datetime.utcnow() - retention)
+        click.echo(f'{pruned} evento(s) de estado antiguos eliminados.')
+
+
+@bp.cli.command('seed')
+def seed_command():
+    """Crea las tablas si no existen y los usuarios de desarrollo."""
+    db.create_all()
+
+    dev_users = [
+        ('Admin', 'admin'),
+        ('vendedor', 'vendedor'),
+        ('tecnico', 'tecnico'),
+        ('administrativo1', 'administrativo'),
+    ]
+    for username, role in dev_users:
+        if not User.query.filter_by(username=username).first():
+            user = User(username=username, role=role)
+            user.set_password('')
+            db.session.add(user)
+            click.echo(f"Usuario '{username}' creado para desarrollo local.")
+
+    db.session.commit()
+
+@bp.cli.command('bench-startup')
+@click.option('--runs', default=5, show_default=True, help='Cantidad de arranques a medir.')
+def bench_startup_command(runs):
+    """Mide cuánto tarda en arrancar un worker (importar app.py y ejecutar create_app)."""
+    code = (
+        'import time; t = time.perf_counter(); '
+        'import app; app.create_app(); '
+        'print(time.perf_counter() - t)'
+    )
+    # Sin FLASK_RUN_FROM_CLI el proceso arranca igual que un worker de gunicorn
+    env = {key: value for key, value in os.environ.items() if key != 'FLASK_RUN_FROM_CLI'}
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=basedir, env=env, check=True, capture_output=True, text=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    timings.sort()
+    click.echo(f'Arranque del worker ({runs} ejecuciones): '
+               f'mínimo {timings[0] * 1000:.0f} ms, mediana {timings[len(timings) // 2] * 1000:.0f} ms, '
+               f'máximo {timings[-1] * 1000:.0f} ms')
+
+@bp.cli.command('compile-templates')
+def compile_templates_command():
+    """Compila todas las plantillas y guarda el bytecode en la caché compartida."""
+    env = current_app.jinja_env
+    names = env.list_templates(extensions=['html'])
+    for name in names:
+        env.get_template(name)
+    click.echo(f'{len(names)} plantilla(s) compiladas en {current_app.config["TEMPLATE_BYTECODE_CACHE_DIR"]}.')
+
+@bp.cli.command('bench-templates')
+@click.option('--rows', default=2000, show_default=True, help='Cantidad de equipos en la lista.')
+@click.option('--runs', default=5, show_default=True, help='Renderizados por escenario.')
+def bench_templates_command(rows, runs):
+    """Compara el tiempo de render de list_devices.html con y sin caché de fragmentos."""
+    env = current_app.jinja_env
+    now = datetime.utcnow()
+    statuses = list(STATUS_BADGES)
+    devices = [
+        Device(id=i, tracking_code=f'OT-{i:08d}', customer_full_name=f'Cliente {i}', brand='Marca',
+               model='Modelo', current_status=statuses[i % len(statuses)], reception_date=now, updated_at=now)
+        for i in range(1, rows + 1)
+    ]
+
+    def render_times():
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            render_template('list_devices.html', devices=devices, branches=BRANCHES, selected_branch=None)
+            timings.append(time.perf_counter() - started)
+        return sorted(timings)[len(timings) // 2] * 1000
+
+    with current_app.test_request_context('/admin/devices'):
+        session['role'] = 'admin'
+        cache = getattr(env, 'fragment_cache', None)
+        env.fragment_cache = None
+        without_cache = render_times()
+        env.fragment_cache = FragmentCache(rows * 2)
+        render_template('list_devices.html', devices=devices, branches=BRANCHES, selected_branch=None)
+        with_cache = render_times()
+        env.fragment_cache = cache
+
+    click.echo(f'list_devices.html con {rows} equipos (mediana de {runs}): '
+               f'sin caché {without_cache:.1f} ms, con caché de fragmentos {with_cache:.1f} ms '
+               f'({without_cache / with_cache:.1f}x)')
+
+@bp.cli.command('reconcile-kpis')
+def reconcile_kpis_command():
+    """Recalcula los contadores del panel de control (programarlo, p. ej., cada noche con cron)."""
+    counts = reconcile_kpi_counters()
+    click.echo(f'{len(counts)} contador(es) recalculados.')
+
+@bp.cli.command('import-stock')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_stock_command(path):
+    """Importa un archivo CSV de reposición del proveedor (nombre, cantidad, precio)."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        imported, errors = import_stock_rows(csv.DictReader(f), reference=f'Importación {os.path.basename(path)}')
+    for error in errors:
+        click.echo(error, err=True)
+    click.echo(f'{imported} ingreso(s) de stock importados.')
+
+
+# --- 6. Fábrica de la Aplicación ---
+def create_app(config_class=Config):
+    """Crea y configura la aplicación. Gunicorn la carga con `app:create_app()`."""
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+
+    # Asegura que los directorios de subidas existan
+    for folder in (app.config['UPLOAD_FOLDER'], app.config['UPLOAD_INCOMING_FOLDER'],
+                   app.config['QR_CACHE_FOLDER'], app.config['TEMPLATE_BYTECODE_CACHE_DIR']):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    # Los workers comparten el bytecode de las plantillas ya compiladas (ver `flask compile-templates`)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_BYTECODE_CACHE_DIR'])
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_SIZE']) if app.config['FRAGMENT_CACHE_SIZE'] else None
+
+    db.init_app(app)
+
+    # Flask-Migrate (y Alembic) solo se necesitan para los comandos `flask db ...`
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    app.register_blueprint(bp)
+    return app
 
 
 if __name__ == '__main__':
-    with app.app_context():
-        if not os.path.exists(os.path.join(basedir, 'instance', 'site.db')):
-            db.create_all()
-            print("Base de datos creada.")
-
-        # Lógica para desarrollo (se ejecuta solo si el archivo se corre directamente)
-        if not User.query.filter_by(username='Admin').first():
-            admin_user = User(username='Admin', role='admin')
-            admin_user.set_password('')
-            db.session.add(admin_user)
-            print("Usuario 'Admin' creado para el entorno de desarrollo.")
-            
-        if not User.query.filter_by(username='vendedor').first():
-            vendedor_user = User(username='vendedor', role='vendedor')
-            vendedor_user.set_password('')
-            db.session.add(vendedor_user)
-            print("Usuario 'vendedor1' creado para desarrollo local.")
-            
-        if not User.query.filter_by(username='tecnico').first():
-            tecnico_user = User(username='tecnico', role='tecnico')
-            tecnico_user.set_password('')
-            db.session.add(tecnico_user)
-            print("Usuario 'tecnico' creado para desarrollo local.")
-        
-        if not User.query.filter_by(username='administrativo1').first():
-            admin_user = User(username='administrativo1', role='administrativo')
-            admin_user.set_password('')
-            db.session.add(admin_user)
-            print("Usuario 'administrativo1' creado para desarrollo local.")
-        
-        db.session.commit()
-            
-    app.run(debug=True)
\ No newline at end of file
+    # Para crear la base y los usuarios de desarrollo: `flask seed`
+    create_app().run(debug=True)
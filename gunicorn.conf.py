@@ -0,0 +1,29 @@
+# Configuración de Gunicorn.
+# El canal SSE (/admin/events/status y /track/<codigo>/events) mantiene conexiones
+# abiertas. Si gevent y psycogreen están instalados se usa gevent por defecto: cada cliente
+# es una greenlet y no bloquea un hilo. psycogreen es imprescindible con PostgreSQL: sin él
+# cada consulta de psycopg2 bloquea todas las greenlets del worker. Si falta alguno se usa
+# "gthread", donde cada conexión ocupa un hilo; por eso los canales SSE tienen un tope por
+# proceso (PUBLIC_STREAM_MAX_CONNECTIONS + STAFF_STREAM_MAX_CONNECTIONS < GUNICORN_THREADS).
+import importlib.util
+import os
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+gevent_ready = all(importlib.util.find_spec(module) for module in ('gevent', 'psycogreen'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent' if gevent_ready else 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = 120
+
+
+def post_fork(server, worker):
+    # Con gevent, psycopg2 tiene que ceder el control a otras greenlets mientras espera al servidor
+    if 'gevent' in worker_class:
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            server.log.warning('Workers gevent sin psycogreen: las consultas a PostgreSQL bloquearán el worker.')
+        else:
+            patch_psycopg()
@@ -97,6 +97,14 @@ def run_migrations_online():
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        # En SQLite, batch_alter_table recrea las tablas (DROP + RENAME); con las claves
+        # externas activas (ver enable_sqlite_foreign_keys en app.py) el DROP de una tabla
+        # referenciada falla. Se desactivan durante la migración, fuera de toda transacción.
+        is_sqlite = connection.dialect.name == 'sqlite'
+        if is_sqlite:
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            connection.commit()
+
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
@@ -106,6 +114,10 @@ def run_migrations_online():
         with context.begin_transaction():
             context.run_migrations()
 
+        if is_sqlite:
+            connection.commit()
+            connection.exec_driver_sql('PRAGMA foreign_keys=ON')
+
 
 if context.is_offline_mode():
     run_migrations_offline()
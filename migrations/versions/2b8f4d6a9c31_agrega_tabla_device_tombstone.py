@@ -0,0 +1,38 @@
+"""agrega tabla device_tombstone para sincronizar bajas por la API
+
+Revision ID: 2b8f4d6a9c31
+Revises: 7c3e9a1f5b62
+Create Date: 2026-10-19 19:12:44.207315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b8f4d6a9c31'
+down_revision = '7c3e9a1f5b62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('device_tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('device_id', sa.Integer(), nullable=False),
+    sa.Column('tracking_code', sa.String(length=20), nullable=False),
+    sa.Column('branch', sa.String(length=50), nullable=True),
+    sa.Column('reason', sa.Enum('deleted', 'archived', name='device_tombstone_reason_enum'), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_device_tombstone'))
+    )
+    with op.batch_alter_table('device_tombstone', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_device_tombstone_deleted_at'), ['deleted_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('device_tombstone', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_device_tombstone_deleted_at'))
+
+    op.drop_table('device_tombstone')
+    sa.Enum(name='device_tombstone_reason_enum').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,39 @@
+"""agrega tabla status_event para el canal SSE de estados
+
+Revision ID: 3f6c2a9d1b47
+Revises: e08810696d4c
+Create Date: 2026-10-19 10:12:31.418522
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6c2a9d1b47'
+down_revision = 'e08810696d4c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('status_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('device_id', sa.Integer(), nullable=False),
+    sa.Column('tracking_code', sa.String(length=20), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('action', sa.String(length=30), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_status_event'))
+    )
+    with op.batch_alter_table('status_event', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_status_event_device_id'), ['device_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_status_event_tracking_code'), ['tracking_code'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('status_event', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_status_event_tracking_code'))
+        batch_op.drop_index(batch_op.f('ix_status_event_device_id'))
+
+    op.drop_table('status_event')
@@ -0,0 +1,34 @@
+"""índices compuestos por sucursal en device y user
+
+Revision ID: 5e2f7b8c9a13
+Revises: c5b93e1a6d24
+Create Date: 2026-10-19 13:40:18.902215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2f7b8c9a13'
+down_revision = 'c5b93e1a6d24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('device', schema=None) as batch_op:
+        batch_op.create_index('ix_device_branch_status_reception_date', ['branch', 'current_status', 'reception_date'], unique=False)
+        batch_op.create_index('ix_device_branch_status_delivery_date', ['branch', 'current_status', 'delivery_date'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_branch'), ['branch'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_branch'))
+
+    with op.batch_alter_table('device', schema=None) as batch_op:
+        batch_op.drop_index('ix_device_branch_status_delivery_date')
+        batch_op.drop_index('ix_device_branch_status_reception_date')
@@ -0,0 +1,69 @@
+"""agrega libro de movimientos de stock e índice de stock bajo
+
+Revision ID: 7c3e9a1f5b62
+Revises: d41a6f2b8e07
+Create Date: 2026-10-19 17:42:10.318274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3e9a1f5b62'
+down_revision = 'd41a6f2b8e07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stock_movement',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('component_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.Enum('receipt', 'consumption', 'adjustment', name='stock_movement_kind_enum'), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('balance_after', sa.Integer(), nullable=False),
+    sa.Column('unit_cost', sa.Float(), nullable=True),
+    sa.Column('repair_id', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('reference', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['component_id'], ['component.id'], name=op.f('fk_stock_movement_component_id_component')),
+    sa.ForeignKeyConstraint(['repair_id'], ['repair.id'], name=op.f('fk_stock_movement_repair_id_repair'), ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_stock_movement'))
+    )
+    with op.batch_alter_table('stock_movement', schema=None) as batch_op:
+        batch_op.create_index('ix_stock_movement_component_id_created_at', ['component_id', 'created_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_stock_movement_repair_id'), ['repair_id'], unique=False)
+
+    with op.batch_alter_table('component', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_component_stock_quantity'), ['stock_quantity'], unique=False)
+
+    # Saldo inicial: un ajuste por componente para que el libro cuadre con el stock actual
+    op.execute(
+        "INSERT INTO stock_movement (component_id, kind, quantity, balance_after, unit_cost, reference, created_at) "
+        "SELECT id, 'adjustment', stock_quantity, stock_quantity, price, 'Saldo inicial', CURRENT_TIMESTAMP "
+        "FROM component"
+    )
+
+    # Valor del inventario para el panel (mismo cálculo que `flask reconcile-kpis`); desde acá
+    # los cambios de stock y precio solo suman o restan la diferencia
+    component = sa.table('component', sa.column('stock_quantity'), sa.column('price'))
+    inventory_value = op.get_bind().execute(
+        sa.select(sa.func.sum(component.c.stock_quantity * component.c.price))
+    ).scalar()
+    kpi_counter = sa.table('kpi_counter', sa.column('key', sa.String), sa.column('value', sa.Integer))
+    op.bulk_insert(kpi_counter, [{'key': 'inventory_value_cents', 'value': int(round((inventory_value or 0) * 100))}])
+
+
+def downgrade():
+    with op.batch_alter_table('component', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_component_stock_quantity'))
+
+    with op.batch_alter_table('stock_movement', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stock_movement_repair_id'))
+        batch_op.drop_index('ix_stock_movement_component_id_created_at')
+
+    op.drop_table('stock_movement')
+    op.execute("DELETE FROM kpi_counter WHERE key = 'inventory_value_cents'")
+    sa.Enum(name='stock_movement_kind_enum').drop(op.get_bind(), checkfirst=True)
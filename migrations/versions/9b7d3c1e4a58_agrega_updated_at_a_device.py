@@ -0,0 +1,26 @@
+"""agrega device.updated_at para la caché de fragmentos
+
+Revision ID: 9b7d3c1e4a58
+Revises: 5e2f7b8c9a13
+Create Date: 2026-10-19 14:55:43.117630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b7d3c1e4a58'
+down_revision = '5e2f7b8c9a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('device', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('device', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,49 @@
+"""ON DELETE CASCADE en reparaciones y componentes usados, índices para archivado
+
+Revision ID: c5b93e1a6d24
+Revises: 8a1d4e7c2f90
+Create Date: 2026-10-19 12:21:07.540318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5b93e1a6d24'
+down_revision = '8a1d4e7c2f90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Los borrados anteriores no eran en cascada y pudieron dejar filas huérfanas, que
+    # romperían las claves externas nuevas: se eliminan antes de recrear las tablas
+    op.execute('DELETE FROM repair WHERE device_id NOT IN (SELECT id FROM device)')
+    op.execute('DELETE FROM repair_component WHERE repair_id NOT IN (SELECT id FROM repair)')
+
+    with op.batch_alter_table('repair', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_repair_device_id_device', type_='foreignkey')
+        batch_op.create_foreign_key(batch_op.f('fk_repair_device_id_device'), 'device', ['device_id'], ['id'], ondelete='CASCADE')
+        batch_op.create_index(batch_op.f('ix_repair_device_id'), ['device_id'], unique=False)
+
+    with op.batch_alter_table('repair_component', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_repair_component_repair_id_repair', type_='foreignkey')
+        batch_op.create_foreign_key(batch_op.f('fk_repair_component_repair_id_repair'), 'repair', ['repair_id'], ['id'], ondelete='CASCADE')
+
+    with op.batch_alter_table('device', schema=None) as batch_op:
+        batch_op.create_index('ix_device_current_status_delivery_date', ['current_status', 'delivery_date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('device', schema=None) as batch_op:
+        batch_op.drop_index('ix_device_current_status_delivery_date')
+
+    with op.batch_alter_table('repair_component', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_repair_component_repair_id_repair', type_='foreignkey')
+        batch_op.create_foreign_key(batch_op.f('fk_repair_component_repair_id_repair'), 'repair', ['repair_id'], ['id'])
+
+    with op.batch_alter_table('repair', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_repair_device_id'))
+        batch_op.drop_constraint('fk_repair_device_id_device', type_='foreignkey')
+        batch_op.create_foreign_key(batch_op.f('fk_repair_device_id_device'), 'device', ['device_id'], ['id'])
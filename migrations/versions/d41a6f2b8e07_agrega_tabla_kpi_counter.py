@@ -0,0 +1,57 @@
+"""agrega tabla kpi_counter para el panel de control
+
+Revision ID: d41a6f2b8e07
+Revises: 9b7d3c1e4a58
+Create Date: 2026-10-19 16:08:25.663491
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41a6f2b8e07'
+down_revision = '9b7d3c1e4a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('kpi_counter',
+    sa.Column('key', sa.String(length=100), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('key', name=op.f('pk_kpi_counter'))
+    )
+
+    # Carga inicial con las mismas consultas que `flask reconcile-kpis`: los cambios posteriores
+    # solo suman o restan diferencias, así que la tabla no puede arrancar vacía
+    bind = op.get_bind()
+    device = sa.table('device', sa.column('id'), sa.column('branch'), sa.column('current_status'),
+                      sa.column('assigned_technician_id'))
+    component = sa.table('component', sa.column('id'), sa.column('stock_quantity'))
+    kpi_counter = sa.table('kpi_counter', sa.column('key', sa.String), sa.column('value', sa.Integer))
+
+    counters = []
+    for branch, status, total in bind.execute(
+        sa.select(device.c.branch, device.c.current_status, sa.func.count(device.c.id))
+        .group_by(device.c.branch, device.c.current_status)
+    ):
+        counters.append({'key': f'status:{branch}:{status}', 'value': total})
+    for technician_id, total in bind.execute(
+        sa.select(device.c.assigned_technician_id, sa.func.count(device.c.id))
+        .where(device.c.assigned_technician_id.isnot(None),
+               device.c.current_status.in_(['Ingresado', 'Observacion', 'Reparacion']))
+        .group_by(device.c.assigned_technician_id)
+    ):
+        counters.append({'key': f'workload:{technician_id}', 'value': total})
+    low_stock = bind.execute(
+        sa.select(sa.func.count(component.c.id))
+        .where(component.c.stock_quantity <= current_app.config.get('LOW_STOCK_THRESHOLD', 2))
+    ).scalar()
+    counters.append({'key': 'low_stock', 'value': low_stock or 0})
+    op.bulk_insert(kpi_counter, counters)
+
+
+def downgrade():
+    op.drop_table('kpi_counter')
@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from app import Config, create_app, db, User
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmp_path, 'test.db')
+        UPLOAD_FOLDER = os.path.join(tmp_path, 'uploads')
+        UPLOAD_INCOMING_FOLDER = os.path.join(tmp_path, 'incoming')
+        QR_CACHE_FOLDER = os.path.join(tmp_path, 'qr')
+        ARCHIVE_FOLDER = os.path.join(tmp_path, 'archive')
+        TEMPLATE_BYTECODE_CACHE_DIR = os.path.join(tmp_path, 'jinja_cache')
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        admin = User(username='Admin', role='admin')
+        admin.set_password('admin')
+        db.session.add(admin)
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, username, password):
+    return client.post('/login', data={'username': username, 'password': password})
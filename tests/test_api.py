@@ -0,0 +1,73 @@
+from datetime import datetime
+
+import pytest
+
+from app import db, delete_device_job, Device, User
+from conftest import login
+
+
+@pytest.fixture
+def branch_client(app, client):
+    admin = User.query.filter_by(username='Admin').one()
+    clerk = User(username='caja', role='administrativo', branch='Sucursal Principal')
+    clerk.set_password('secreto')
+    db.session.add(clerk)
+    for code, branch in (('OT-1', 'Sucursal Principal'), ('OT-2', 'Sucursal Norte'), ('OT-3', 'Sucursal Norte')):
+        db.session.add(Device(
+            tracking_code=code, user_id=admin.id, branch=branch, brand='Marca', model='Modelo',
+            problem_description='No enciende', customer_full_name='Cliente', customer_phone='555'
+        ))
+    db.session.commit()
+    login(client, 'caja', 'secreto')
+    return client
+
+
+def test_batch_is_scoped_to_user_branch(branch_client):
+    listed = branch_client.get('/api/v1/devices').get_json()
+    batch = branch_client.get('/api/v1/devices/batch?ids=1,2,3&tracking_codes=OT-3').get_json()
+
+    assert [d['id'] for d in listed['data']] == [1]
+    assert [d['id'] for d in batch['data']] == [1]
+    assert batch['missing'] == {'ids': [2, 3], 'tracking_codes': ['OT-3']}
+
+
+@pytest.mark.parametrize('body', [
+    [1, 2],
+    {'tracking_codes': 5},
+    {'ids': '1,2'},
+    {'ids': [[1]]},
+    {'ids': [True]},
+    {'ids': ['uno']},
+    {'tracking_codes': [{'code': 'OT-1'}]},
+])
+def test_batch_rejects_malformed_bodies(branch_client, body):
+    response = branch_client.post('/api/v1/devices/batch', json=body)
+
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_batch_post_accepts_ids_and_codes(branch_client):
+    response = branch_client.post('/api/v1/devices/batch', json={'ids': [1, '2'], 'tracking_codes': ['OT-1']})
+
+    assert response.status_code == 200
+    assert [d['id'] for d in response.get_json()['data']] == [1]
+
+
+def test_list_has_no_last_modified_validator(branch_client):
+    response = branch_client.get('/api/v1/devices')
+
+    assert response.headers.get('ETag')
+    assert 'Last-Modified' not in response.headers
+    assert branch_client.get('/api/v1/devices', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_deleted_devices_feed(app, branch_client):
+    since = datetime.utcnow().isoformat()
+    delete_device_job(1)
+    delete_device_job(2)
+    db.session.commit()
+
+    feed = branch_client.get(f'/api/v1/devices/deleted?since={since}').get_json()
+    assert [(d['id'], d['tracking_code'], d['reason']) for d in feed['data']] == [(1, 'OT-1', 'deleted')]
+    assert branch_client.get('/api/v1/devices/deleted?since=ayer').status_code == 400
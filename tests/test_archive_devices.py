@@ -0,0 +1,86 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as app_module
+from app import db, archive_delivered_devices, Device, DeviceTombstone, User
+
+
+def create_delivered_device(app, photos):
+    admin = User.query.filter_by(username='Admin').one()
+    device = Device(
+        tracking_code='OT-ARCH', user_id=admin.id, brand='Marca', model='Modelo',
+        problem_description='No enciende', customer_full_name='Cliente', customer_phone='555',
+        current_status='Retirado', delivery_date=datetime.utcnow() - timedelta(days=400),
+        initial_condition_photo_path=','.join(name for _, name in photos)
+    )
+    db.session.add(device)
+    db.session.commit()
+    for folder, name in photos:
+        with open(os.path.join(app.config[folder], name), 'wb') as f:
+            f.write(b'foto')
+    return device.id
+
+
+def test_archive_moves_photos_from_both_folders(app):
+    device_id = create_delivered_device(app, [('UPLOAD_FOLDER', 'a.jpg'), ('UPLOAD_INCOMING_FOLDER', 'b.jpg')])
+
+    archived, archive_path = archive_delivered_devices(datetime.utcnow() - timedelta(days=365))
+
+    assert archived == 1
+    assert os.path.exists(archive_path)
+    assert db.session.get(Device, device_id) is None
+    assert [(t.tracking_code, t.reason) for t in DeviceTombstone.query.all()] == [('OT-ARCH', 'archived')]
+    photos_dir = os.path.join(app.config['ARCHIVE_FOLDER'], 'photos')
+    assert sorted(os.listdir(photos_dir)) == ['a.jpg', 'b.jpg']
+    assert not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], 'a.jpg'))
+    assert not os.path.exists(os.path.join(app.config['UPLOAD_INCOMING_FOLDER'], 'b.jpg'))
+
+
+def test_failed_batch_keeps_device_photos(app, monkeypatch):
+    device_id = create_delivered_device(app, [('UPLOAD_FOLDER', 'a.jpg')])
+
+    def failing_apply(connection, deltas):
+        raise RuntimeError('fallo simulado')
+    monkeypatch.setattr(app_module, 'apply_kpi_deltas', failing_apply)
+
+    with pytest.raises(RuntimeError):
+        archive_delivered_devices(datetime.utcnow() - timedelta(days=365))
+    db.session.rollback()
+
+    assert db.session.get(Device, device_id) is not None
+    assert os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], 'a.jpg'))
+
+
+def test_each_batch_is_on_disk_before_its_delete(app, monkeypatch):
+    admin = User.query.filter_by(username='Admin').one()
+    for i in range(3):
+        db.session.add(Device(
+            tracking_code=f'OT-{i}', user_id=admin.id, brand='Marca', model='Modelo',
+            problem_description='No enciende', customer_full_name='Cliente', customer_phone='555',
+            current_status='Retirado', delivery_date=datetime.utcnow() - timedelta(days=400)
+        ))
+    db.session.commit()
+
+    archived_paths = []
+    original_append = app_module.append_archive_batch
+
+    def append_and_check(path, lines):
+        original_append(path, lines)
+        archived_paths.append(path)
+        # Lo ya escrito se puede leer completo aunque el proceso muera antes del commit
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            codes = [json.loads(line)['tracking_code'] for line in f]
+        assert Device.query.filter(Device.tracking_code.in_(codes)).count() == len(lines)
+    monkeypatch.setattr(app_module, 'append_archive_batch', append_and_check)
+
+    archived, archive_path = archive_delivered_devices(datetime.utcnow() - timedelta(days=365), batch_size=2)
+
+    assert archived == 3
+    assert archived_paths == [archive_path, archive_path]
+    with gzip.open(archive_path, 'rt', encoding='utf-8') as f:
+        assert [json.loads(line)['tracking_code'] for line in f] == ['OT-0', 'OT-1', 'OT-2']
+    assert Device.query.count() == 0
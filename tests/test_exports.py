@@ -0,0 +1,45 @@
+import io
+
+import pytest
+
+from app import db, Device, User
+from conftest import login
+
+
+@pytest.fixture
+def admin_client(app, client):
+    admin = User.query.filter_by(username='Admin').one()
+    db.session.add(Device(
+        tracking_code='OT-1', user_id=admin.id, brand='Marca', model='Modelo',
+        problem_description='No enciende', customer_full_name='Cliente', customer_phone='555'
+    ))
+    db.session.commit()
+    login(client, 'Admin', 'admin')
+    return client
+
+
+@pytest.mark.parametrize('url', [
+    '/admin/export/repairs?start=bad',
+    '/admin/export/revenue?end=2026-13-01',
+])
+def test_exports_reject_invalid_dates(admin_client, url):
+    response = admin_client.get(url)
+
+    assert response.status_code == 400
+    assert 'AAAA-MM-DD' in response.get_data(as_text=True)
+
+
+def test_revenue_report_warns_on_invalid_dates(admin_client):
+    response = admin_client.get('/admin/revenue_report?start=bad')
+
+    assert response.status_code == 200
+    assert 'AAAA-MM-DD' in response.get_data(as_text=True)
+
+
+def test_devices_export_as_xlsx(admin_client):
+    openpyxl = pytest.importorskip('openpyxl')
+    response = admin_client.get('/admin/export/devices?format=xlsx')
+
+    assert response.status_code == 200
+    sheet = openpyxl.load_workbook(io.BytesIO(response.data)).active
+    assert sheet.max_row == 2
@@ -0,0 +1,58 @@
+from app import db, enqueue_job, work_off_jobs, Device, Job, User
+from conftest import login
+
+
+def create_device(code):
+    admin = User.query.filter_by(username='Admin').one()
+    device = Device(
+        tracking_code=code, user_id=admin.id, brand='Marca', model='Modelo',
+        problem_description='No enciende', customer_full_name='Cliente', customer_phone='555'
+    )
+    db.session.add(device)
+    db.session.commit()
+    return device.id
+
+
+def test_enqueue_dedupes_only_active_jobs(app):
+    first = enqueue_job('delete_device', {'device_id': 1}, idempotency_key='delete_device:1')
+    db.session.commit()
+    assert enqueue_job('delete_device', {'device_id': 1}, idempotency_key='delete_device:1') is first
+
+    first.status = 'done'
+    db.session.commit()
+    second = enqueue_job('delete_device', {'device_id': 1}, idempotency_key='delete_device:1')
+    db.session.commit()
+
+    assert second.id != first.id
+    assert first.idempotency_key is None
+    assert second.idempotency_key == 'delete_device:1'
+
+
+def test_deleting_a_reused_device_id(app, client):
+    login(client, 'Admin', 'admin')
+    first_id = create_device('OT-1')
+    client.post(f'/admin/device/{first_id}/delete')
+    work_off_jobs(app)
+
+    # SQLite reutiliza el id más alto tras un borrado
+    second_id = create_device('OT-2')
+    assert second_id == first_id
+    client.post(f'/admin/device/{second_id}/delete')
+    work_off_jobs(app)
+
+    db.session.expire_all()
+    assert Device.query.count() == 0
+    assert Job.query.filter_by(kind='delete_device', status='done').count() == 2
+
+
+def test_ticket_qr_is_served_and_cached(app, client):
+    create_device('OT-1')
+
+    page = client.get('/ticket/OT-1').get_data(as_text=True)
+    assert '/ticket/OT-1/qr.png' in page
+
+    response = client.get('/ticket/OT-1/qr.png')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert response.data.startswith(b'\x89PNG')
+    assert client.get('/ticket/NOPE/qr.png').status_code == 404
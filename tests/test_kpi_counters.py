@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+from app import db, apply_kpi_deltas, count_overdue_pickups, reconcile_kpi_counters, Device, KpiCounter, Repair, User
+from conftest import login
+
+
+def create_finished_device(code, branch, days_since_completion):
+    admin = User.query.filter_by(username='Admin').one()
+    device = Device(
+        tracking_code=code, user_id=admin.id, branch=branch, brand='Marca', model='Modelo',
+        problem_description='No enciende', customer_full_name='Cliente', customer_phone='555',
+        current_status='Terminado'
+    )
+    db.session.add(device)
+    db.session.flush()
+    db.session.add(Repair(
+        device_id=device.id, description='Cambio de pantalla', status='Terminado',
+        end_date=datetime.utcnow() - timedelta(days=days_since_completion)
+    ))
+    db.session.commit()
+
+
+def test_overdue_pickups_are_counted_on_read(app, client):
+    create_finished_device('OT-1', 'Sucursal Principal', 10)
+    create_finished_device('OT-2', 'Sucursal Norte', 7)
+    create_finished_device('OT-3', 'Sucursal Principal', 1)
+
+    assert count_overdue_pickups() == 2
+    assert count_overdue_pickups('Sucursal Principal') == 1
+
+    reconcile_kpi_counters()
+    assert not KpiCounter.query.filter(KpiCounter.key.like('overdue_pickups:%')).count()
+
+    login(client, 'Admin', 'admin')
+    assert client.get('/admin').status_code == 200
+
+
+def test_status_counters_follow_status_changes(app):
+    create_finished_device('OT-1', 'Sucursal Principal', 1)
+    device = Device.query.filter_by(tracking_code='OT-1').one()
+    device.current_status = 'Retirado'
+    db.session.commit()
+
+    counters = dict(db.session.query(KpiCounter.key, KpiCounter.value))
+    assert counters['status:Sucursal Principal:Terminado'] == 0
+    assert counters['status:Sucursal Principal:Retirado'] == 1
+    assert reconcile_kpi_counters()['status:Sucursal Principal:Retirado'] == 1
+
+
+def test_apply_kpi_deltas_upserts_new_and_existing_keys(app):
+    with db.engine.begin() as connection:
+        apply_kpi_deltas(connection, {'workload:7': 1, 'low_stock': 0})
+    with db.engine.begin() as connection:
+        apply_kpi_deltas(connection, {'workload:7': 2, 'status:Sucursal Sur:Ingresado': -1})
+
+    counters = dict(db.session.query(KpiCounter.key, KpiCounter.value))
+    assert counters == {'workload:7': 3, 'status:Sucursal Sur:Ingresado': -1}
@@ -0,0 +1,66 @@
+from sqlalchemy import func, insert
+
+from app import db, Device, User
+from conftest import login
+
+
+def create_user(username, role):
+    user = User(username=username, role=role)
+    user.set_password('secreto')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def bulk_devices(count, prefix, user_id, technician_id=None):
+    db.session.execute(insert(Device), [
+        {
+            'tracking_code': f'{prefix}-{i}',
+            'user_id': user_id,
+            'assigned_technician_id': technician_id,
+            'brand': 'Marca',
+            'model': 'Modelo',
+            'problem_description': 'No enciende',
+            'customer_full_name': 'Cliente',
+            'customer_phone': '555',
+        }
+        for i in range(count)
+    ])
+    db.session.commit()
+
+
+def test_delete_user_with_large_history(app, client):
+    admin_id = User.query.filter_by(username='Admin').one().id
+    technician_id = create_user('tecnico1', 'tecnico')
+    other_technician_id = create_user('tecnico2', 'tecnico')
+
+    bulk_devices(3000, 'REG', user_id=technician_id)
+    bulk_devices(2000, 'ASG', user_id=admin_id, technician_id=technician_id)
+    bulk_devices(500, 'OTR', user_id=admin_id, technician_id=other_technician_id)
+
+    login(client, 'Admin', 'admin')
+    response = client.post('/admin/manage_users', data={'action': 'delete', 'user_id': str(technician_id)})
+
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert 'Equipos reasignados: 3000.' in page
+    assert 'Equipos sin técnico asignado: 2000.' in page
+
+    db.session.expire_all()
+    assert db.session.get(User, technician_id) is None
+    assert Device.query.count() == 5500
+    assert Device.query.filter_by(user_id=technician_id).count() == 0
+    assert Device.query.filter_by(assigned_technician_id=technician_id).count() == 0
+    assert Device.query.filter(Device.tracking_code.like('REG-%'), Device.user_id == admin_id).count() == 3000
+    assert Device.query.filter(Device.tracking_code.like('ASG-%'), Device.assigned_technician_id.is_(None)).count() == 2000
+    assert Device.query.filter_by(assigned_technician_id=other_technician_id).count() == 500
+    assert db.session.query(func.count(User.id)).scalar() == 2
+
+
+def test_cannot_delete_self(app, client):
+    admin_id = User.query.filter_by(username='Admin').one().id
+    login(client, 'Admin', 'admin')
+    response = client.post('/admin/manage_users', data={'action': 'delete', 'user_id': str(admin_id)})
+
+    assert 'No se puede eliminar un usuario administrador o a ti mismo.' in response.get_data(as_text=True)
+    assert db.session.get(User, admin_id) is not None
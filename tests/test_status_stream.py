@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+import app as app_module
+from app import db, prune_status_events, Device, StatusEvent, User
+from conftest import login
+
+
+def test_streams_are_capped_per_channel(app, client):
+    app.config.update(STAFF_STREAM_MAX_CONNECTIONS=1, STATUS_STREAM_MAX_SECONDS=0, PUBLIC_STREAM_MAX_CONNECTIONS=0)
+    admin = User.query.filter_by(username='Admin').one()
+    db.session.add(Device(
+        tracking_code='OT-1', user_id=admin.id, brand='Marca', model='Modelo',
+        problem_description='No enciende', customer_full_name='Cliente', customer_phone='555'
+    ))
+    db.session.commit()
+    login(client, 'Admin', 'admin')
+
+    first = client.get('/admin/events/status', buffered=False)
+    second = client.get('/admin/events/status')
+    assert app_module._stream_counts['staff'] == 1
+    assert second.get_data(as_text=True) == 'retry: 60000\n\n'
+    first.close()
+    assert app_module._stream_counts['staff'] == 0
+
+    assert client.get('/track/OT-1/events').get_data(as_text=True) == 'retry: 60000\n\n'
+    assert app_module._stream_counts['public'] == 0
+
+
+def test_prune_status_events_keeps_newest(app):
+    old = datetime.utcnow() - timedelta(days=30)
+    for i in range(3):
+        db.session.add(StatusEvent(device_id=1, tracking_code='OT-1', status='Ingresado', action='create', created_at=old))
+    db.session.commit()
+
+    assert prune_status_events(datetime.utcnow() - timedelta(days=7)) == 2
+    assert [e.id for e in StatusEvent.query.all()] == [3]
@@ -0,0 +1,72 @@
+from sqlalchemy import update
+
+from app import db, import_stock_rows, Component, Device, Repair, StockMovement, User
+from conftest import login
+
+
+def create_repair():
+    admin = User.query.filter_by(username='Admin').one()
+    device = Device(
+        tracking_code='OT-1', user_id=admin.id, brand='Marca', model='Modelo',
+        problem_description='No enciende', customer_full_name='Cliente', customer_phone='555'
+    )
+    db.session.add(device)
+    db.session.flush()
+    repair = Repair(device_id=device.id, description='Cambio de pantalla')
+    db.session.add(repair)
+    db.session.commit()
+    return repair.id
+
+
+def change_stock_elsewhere(component_id, stock_quantity):
+    # Simula otra transacción que ya consumió stock, sin pasar por la sesión de la prueba
+    with db.engine.begin() as connection:
+        connection.execute(update(Component).where(Component.id == component_id).values(stock_quantity=stock_quantity))
+
+
+def test_consumption_uses_stock_read_under_lock(app, client):
+    repair_id = create_repair()
+    component = Component(name='Pantalla', stock_quantity=5, price=10.0)
+    db.session.add(component)
+    db.session.commit()
+    assert component.stock_quantity == 5  # queda cargado en la sesión con stock 5
+    change_stock_elsewhere(component.id, 1)
+
+    login(client, 'Admin', 'admin')
+    response = client.post(f'/admin/repair/{repair_id}/manage_components',
+                           data={'component_id': str(component.id), 'quantity_used': '3'})
+
+    assert 'Stock insuficiente' in response.get_data(as_text=True)
+    db.session.expire_all()
+    assert db.session.get(Component, component.id).stock_quantity == 1
+    assert StockMovement.query.filter_by(kind='consumption').count() == 0
+
+
+def test_adjustment_records_difference_from_current_stock(app, client):
+    component = Component(name='Batería', stock_quantity=5, price=7.0)
+    db.session.add(component)
+    db.session.commit()
+    assert component.stock_quantity == 5
+    change_stock_elsewhere(component.id, 2)
+
+    login(client, 'Admin', 'admin')
+    client.post(f'/admin/stock/{component.id}/movement', data={'kind': 'adjustment', 'quantity': '4'})
+
+    movement = StockMovement.query.filter_by(kind='adjustment').one()
+    assert (movement.quantity, movement.balance_after) == (2, 4)
+
+
+def test_import_adds_to_stock_read_under_lock(app):
+    component = Component(name='Pantalla', stock_quantity=5, price=10.0)
+    db.session.add(component)
+    db.session.commit()
+    assert component.stock_quantity == 5
+    change_stock_elsewhere(component.id, 2)
+
+    imported, errors = import_stock_rows([{'nombre': 'Pantalla', 'cantidad': '3'}], reference='Proveedor')
+
+    assert (imported, errors) == (1, [])
+    movement = StockMovement.query.filter_by(kind='receipt').one()
+    assert movement.balance_after == 5
+    db.session.expire_all()
+    assert db.session.get(Component, component.id).stock_quantity == 5